@@ -1,82 +1,914 @@
+import heapq
 import smartpy as sp
 import uuid
 
+# Bits of the packed `state` field: status codes in the low two bits, then
+# the cancellation flag of each party.
+STATUS_BITS = {0: 0, 1: 1, 2: 2, -1: 3}
+WITHDRAWN_BITS = {"owner": 4, "counterparty": 8}
+
+# Width in seconds of the buckets of the expiry queue. Entries within a bucket
+# are kept in activation order, so a sweep may wait up to one bucket for an
+# entry queued behind a later deadline.
+EXPIRY_BUCKET_SECONDS = 3600
+
+# Fields of the `stats` record counting commissions in each status.
+STATUS_COUNTERS = {0: "pending", 1: "active", 2: "completed", -1: "cancelled"}
+
+# Commission metadata kept off-chain is addressed by a blake2b-256 digest and
+# a short URI (see metadata_store.py).
+METADATA_HASH_LENGTH = 32
+MAX_METADATA_URI_LENGTH = 96
+
+# Field changes accepted by updateTransactions, one variant case each.
+TRANSACTION_UPDATES = dict(
+    epoch=sp.TTimestamp,
+    duration=sp.TNat,
+    owner=sp.TAddress,
+    counterparty=sp.TAddress,
+    offer=sp.TMutez,
+    fee=sp.TMutez,
+    secret=sp.TString,
+    status=sp.TInt,
+)
+TTransactionUpdate = sp.TVariant(**TRANSACTION_UPDATES)
+
+# Relative call frequencies of the entrypoints in production; any entrypoint
+# not listed weighs 1. Builds made with hotEntrypoints=True shape the
+# dispatch tree by these weights. Entrypoints of equal weight may land one
+# level apart, as the tree is only as balanced as their number allows.
+ENTRYPOINT_WEIGHTS = dict(
+    postCommission=20,
+    acceptCommission=20,
+    depositOwner=20,
+    depositCounterparty=20,
+    approveCommission=20,
+    claimCounterparty=15,
+    claimOwner=5,
+    postAndDeposit=10,
+    acceptAndDeposit=10,
+)
+
+
+def entrypointLayout(names, weights):
+    """Huffman tree of `names` as nested pairs: the tree in which the
+    depth of the entrypoints, weighted by `weights`, is smallest."""
+    heap = [(weights.get(name, 1), index, name)
+            for index, name in enumerate(sorted(names))]
+    heapq.heapify(heap)
+    index = len(heap)
+    while len(heap) > 1:
+        leftWeight, _, left = heapq.heappop(heap)
+        rightWeight, _, right = heapq.heappop(heap)
+        heapq.heappush(heap, (leftWeight + rightWeight, index, (left, right)))
+        index += 1
+    return heap[0][2]
+
+
+# Failure messages by code. Builds made with errorCodes=True fail with the
+# code instead of the message; contract/errors.py exports this table for
+# clients. Codes are never reused: append new messages at the end.
+ERRORS = {
+    1: "Transaction already exists.",
+    2: "Unknown status.",
+    3: "Only the admin can reset!",
+    4: "Only the admin can create a transaction!",
+    5: "Metadata hash must be 32 bytes.",
+    6: "Metadata URI is too long.",
+    7: "Commission details are stored off-chain.",
+    8: "Commission details are stored on-chain.",
+    9: "Only the admin can migrate a commission.",
+    10: "Amount does not match the migrated balances.",
+    11: "Commissions are not keyed by counter.",
+    12: "Transaction does not exist.",
+    13: "Only admin can set transaction details.",
+    14: "Owner already set.",
+    15: "Counterparty already set.",
+    16: "Only the admin can revert the commission funds.",
+    17: "Owner did not cancel the commission.",
+    18: "Counterparty did not cancel the commission.",
+    19: "Transaction has already been completed.",
+    20: "Transaction has already been reverted.",
+    21: "Reverts are not queued.",
+    22: "Only owner can start transaction.",
+    23: "Transaction is not pending.",
+    24: "Both parties must deposit first!",
+    25: "Only the owner can edit the commission reward.",
+    26: "Owner has already deposited.",
+    27: "Only the owner can edit the commission fee.",
+    28: "Counterparty has already deposited.",
+    29: "Only the owner can edit the commission details.",
+    30: "Only the owner can edit the commission description.",
+    31: "Only the owner can cancel the commission.",
+    32: "Only the owner can delete the commission.",
+    33: "Only the owner can deposit funds.",
+    34: "Owner already deposited funds.",
+    35: "Amount does not match offer.",
+    36: "Amount does not match the total offer.",
+    37: "Transaction already has a counterparty.",
+    38: "Only the counterparty can cancel the commission.",
+    39: "Nobody has deposited funds yet. Leave the commission instead.",
+    40: "Only the counterparty can deposit funds.",
+    41: "Counterparty already deposited funds.",
+    42: "Amount does not match fee.",
+    43: "Amount does not match the total fee.",
+    44: "Only the counterparty can leave the commission.",
+    45: "Funds are deposited. Request for cancellation instead.",
+    46: "Owner did not deposit funds.",
+    47: "Counterparty did not deposit funds.",
+    48: "Only the owner can approve the commission.",
+    49: "Nothing to withdraw.",
+    50: "Settlements are paid out directly.",
+    51: "Transaction is not active.",
+    52: "Both parties must deposit!",
+    53: "Only the owner or counterparty can claim!",
+    54: "Only the counterparty can claim!",
+    55: "Counterparty pending withdrawal from commission!",
+    56: "Commission duration expired!",
+    57: "Secret does not match!",
+    58: "Only the owner can claim!",
+    59: "Owner pending withdrawal from commission!",
+    60: "Commission duration not finished!",
+    61: "Expiries are not queued.",
+}
+ERROR_CODES = {message: code for code, message in ERRORS.items()}
+
+# Failure messages of the sender checks, by guard. Builds made with
+# sharedGuards=True compile each table once, into its guard lambda, and the
+# call sites only pass the index of their message.
+GUARD_MESSAGES = dict(
+    master=[
+        "Only the admin can reset!",
+        "Only the admin can create a transaction!",
+        "Only the admin can migrate a commission.",
+        "Only admin can set transaction details.",
+        "Only the admin can revert the commission funds.",
+    ],
+    owner=[
+        "Only the owner can edit the commission reward.",
+        "Only the owner can edit the commission fee.",
+        "Only the owner can edit the commission details.",
+        "Only the owner can edit the commission description.",
+        "Only the owner can cancel the commission.",
+        "Only the owner can delete the commission.",
+        "Only the owner can deposit funds.",
+    ],
+    counterparty=[
+        "Only the counterparty can cancel the commission.",
+        "Only the counterparty can deposit funds.",
+        "Only the counterparty can leave the commission.",
+    ],
+)
+
 
 class Escrow(sp.Contract):
-    def __init__(self, master):
-
-        self.init(
-            master=master,
-            parties=sp.big_map(
-                tkey=sp.TString,
-                tvalue=sp.TRecord(
-                    owner=sp.TOption(sp.TAddress),
-                    counterparty=sp.TOption(sp.TAddress),
+    def __init__(self, master, merged=False, counterIds=False, pullPayments=False, packedStatus=False, lazyEntrypoints=False, offchainMetadata=False, splitDetails=False, userIndex=False, metadataUrl=None, expiryQueue=False, autoRefund=False, revertQueue=False, autoActivate=False, errorCodes=False, sharedGuards=False, hotEntrypoints=False, stats=False):
+        # merged=True keeps the parties and the financial state of a
+        # commission in a single `commissions` big_map record, so that an
+        # entrypoint only deserializes and writes one value. The default keeps
+        # the two-map `parties`/`transactions` layout of deployed contracts.
+        self.merged = merged
+        # counterIds=True keys commissions by a `nat` assigned on-chain from
+        # `nextId` instead of a caller supplied UUID string. String IDs of
+        # migrated or aliased commissions resolve through `legacyIds`, which
+        # the `commissionId` view reads.
+        self.counterIds = counterIds
+        self.keyType = sp.TNat if counterIds else sp.TString
+        # pullPayments=True credits settlements to a per-address `credits`
+        # ledger instead of sending them, and `withdraw` pays out the whole
+        # accumulated balance in one transfer.
+        self.pullPayments = pullPayments
+        # packedStatus=True replaces `status`, `ownerHasWithdrawn` and
+        # `counterpartyHasWithdrawn` by a single `state` nat: the low two bits
+        # hold the status (see STATUS_BITS), then one flag bit per party.
+        self.packedStatus = packedStatus
+        # lazyEntrypoints=True stores every entrypoint not marked
+        # `lazify=False` (the admin setters, edits, cancellations) in a
+        # big_map, from which it is loaded when the entrypoint is called.
+        if lazyEntrypoints:
+            self.add_flag("lazy-entry-points")
+        # offchainMetadata=True stores a fixed-size content hash and a short
+        # URI of the title and description, which live in an off-chain store
+        # (see metadata_store.py), instead of the strings themselves.
+        self.offchainMetadata = offchainMetadata
+        if offchainMetadata:
+            self.detailsType = dict(
+                metadataHash=sp.TBytes,
+                metadataUri=sp.TString,
+            )
+        else:
+            self.detailsType = dict(
+                description=sp.TString,
+                title=sp.TString,
+            )
+        # splitDetails=True moves the fields that almost never change (the
+        # details above and hashedSecret) to a `details` big_map under the
+        # same key. Deposits, approvals and claims then rewrite only the
+        # record holding balances and status.
+        self.splitDetails = splitDetails
+        # userIndex=True maintains `userCommissions`, the IDs each address
+        # owns or is the counterparty of, so a user's commissions are a
+        # single key read instead of an indexer scan of `parties`.
+        self.userIndex = userIndex
+        # metadataUrl adds a TZIP-16 `metadata` big_map pointing at it. The
+        # metadata JSON compiled alongside the contract, which carries the
+        # off-chain views, is what should be published at that URL.
+        self.metadataUrl = metadataUrl
+        # expiryQueue=True queues every activated commission under the
+        # bucket of its deadline, and `sweepExpired` settles expired ones to
+        # their owners in deadline order without an off-chain scan. The
+        # sweep credits the owners, so that one rejecting the transfer
+        # cannot stall the queue.
+        if expiryQueue and not pullPayments:
+            raise ValueError("expiryQueue requires pullPayments.")
+        self.expiryQueue = expiryQueue
+        # autoRefund=True reverts the funds of a commission as soon as both
+        # parties have cancelled it. revertQueue=True keeps the admin
+        # approval instead, and queues such commissions in `revertQueue` for
+        # `processReverts` to revert in bulk, crediting the parties so that
+        # one rejecting the transfer cannot stall the queue.
+        if autoRefund and revertQueue:
+            raise ValueError("autoRefund and revertQueue are exclusive.")
+        if revertQueue and not pullPayments:
+            raise ValueError("revertQueue requires pullPayments.")
+        self.autoRefund = autoRefund
+        self.revertQueue = revertQueue
+        # autoActivate=True starts a commission as soon as both deposits are
+        # in, instead of waiting for the owner's approveCommission.
+        self.autoActivate = autoActivate
+        # errorCodes=True fails with the nat codes of ERRORS instead of the
+        # messages.
+        self.errorCodes = errorCodes
+        # sharedGuards=True compiles the recurring checks (commission
+        # exists, sender is the admin, the owner or the counterparty) and
+        # their failure messages as private lambdas that the entrypoints
+        # call. Other builds inline the checks at each call site.
+        self.sharedGuards = sharedGuards
+        # hotEntrypoints=True replaces the balanced entrypoint tree by the
+        # one built from ENTRYPOINT_WEIGHTS, which nests the frequent calls
+        # nearer the root of the parameter type and the admin setters deeper.
+        self.hotEntrypoints = hotEntrypoints
+        # stats=True keeps the `stats` record of aggregate counters (see
+        # emptyStats) up to date in every transition that moves a commission
+        # between statuses or changes its balances.
+        self.stats = stats
+        coldType = dict(
+            hashedSecret=sp.TOption(sp.TBytes),
+            **self.detailsType,
+        )
+
+        partiesType = dict(
+            owner=sp.TOption(sp.TAddress),
+            counterparty=sp.TOption(sp.TAddress),
+        )
+        transactionType = dict(
+            offer=sp.TMutez,
+            fee=sp.TMutez,
+            balanceOwner=sp.TMutez,
+            balanceCounterparty=sp.TMutez,
+            epoch=sp.TTimestamp,
+            duration=sp.TNat,
+            **coldType,
+        )
+        if self.packedStatus:
+            transactionType.update(state=sp.TNat)
+        else:
+            transactionType.update(
+                ownerHasWithdrawn=sp.TBool,
+                counterpartyHasWithdrawn=sp.TBool,
+                status=sp.TInt,
+            )
+
+        self.partiesType = partiesType
+        self.transactionType = transactionType
+        self.coldType = coldType
+        if self.splitDetails:
+            transactionType = {name: t for name, t in transactionType.items()
+                               if name not in coldType}
+
+        storage = dict(master=master)
+        if self.stats:
+            storage.update(stats=self.emptyStats())
+        if self.merged:
+            storage.update(
+                commissions=sp.big_map(
+                    tkey=self.keyType,
+                    tvalue=sp.TRecord(**partiesType, **transactionType),
                 ),
-            ),
-            transactions=sp.big_map(
-                tkey=sp.TString,
-                tvalue=sp.TRecord(
-                    offer=sp.TMutez,
-                    fee=sp.TMutez,
-                    balanceOwner=sp.TMutez,
-                    balanceCounterparty=sp.TMutez,
-                    epoch=sp.TTimestamp,
-                    duration=sp.TNat,
-                    hashedSecret=sp.TOption(sp.TBytes),
-                    ownerHasWithdrawn=sp.TBool,
-                    counterpartyHasWithdrawn=sp.TBool,
-                    description=sp.TString,
-                    title=sp.TString,
-                    status=sp.TInt,
+            )
+        else:
+            storage.update(
+                parties=sp.big_map(
+                    tkey=self.keyType,
+                    tvalue=sp.TRecord(**partiesType),
                 ),
-            ),
+                transactions=sp.big_map(
+                    tkey=self.keyType,
+                    tvalue=sp.TRecord(**transactionType),
+                ),
+            )
+        if self.splitDetails:
+            storage.update(
+                details=sp.big_map(
+                    tkey=self.keyType,
+                    tvalue=sp.TRecord(**coldType),
+                ),
+            )
+        if self.userIndex:
+            storage.update(
+                userCommissions=sp.big_map(
+                    tkey=sp.TAddress,
+                    tvalue=sp.TRecord(
+                        owner=sp.TSet(self.keyType),
+                        counterparty=sp.TSet(self.keyType),
+                    ),
+                ),
+            )
+        if self.counterIds:
+            storage.update(
+                nextId=sp.nat(0),
+                legacyIds=sp.big_map(tkey=sp.TString, tvalue=sp.TNat),
+            )
+        if self.pullPayments:
+            storage.update(
+                credits=sp.big_map(tkey=sp.TAddress, tvalue=sp.TMutez),
+            )
+        if self.expiryQueue:
+            storage.update(
+                expiries=sp.big_map(
+                    tkey=sp.TPair(sp.TInt, sp.TNat),
+                    tvalue=sp.TRecord(
+                        transactionId=self.keyType,
+                        epoch=sp.TTimestamp,
+                    ),
+                ),
+                expiryCounts=sp.big_map(tkey=sp.TInt, tvalue=sp.TNat),
+                expiryCursor=sp.record(
+                    bucket=sp.int(0),
+                    index=sp.nat(0),
+                    pending=sp.nat(0),
+                ),
+            )
+        if self.revertQueue:
+            storage.update(
+                revertQueue=sp.big_map(tkey=sp.TNat, tvalue=self.keyType),
+                revertCursor=sp.record(head=sp.nat(0), tail=sp.nat(0)),
+                # Commissions with an entry in revertQueue.
+                revertQueued=sp.big_map(tkey=self.keyType, tvalue=sp.TUnit),
+            )
+        if self.metadataUrl is not None:
+            storage.update(
+                metadata=sp.utils.metadata_of_url(self.metadataUrl),
+            )
+
+        self.init(**storage)
+        if self.counterIds:
+            self.addMigrateCommission()
+            self.addLegacyIdView()
+        if self.offchainMetadata:
+            self.addMetadataEntrypoints()
+        if self.pullPayments:
+            self.addWithdraw()
+        if self.expiryQueue:
+            self.addSweepExpired()
+        if self.revertQueue:
+            self.addProcessReverts()
+        if self.userIndex:
+            self.addUserIndexView()
+        if self.metadataUrl is not None:
+            self.addOffchainViews()
+        if self.sharedGuards:
+            self.addSharedGuards()
+        # After the entrypoints of the enabled options are added, so that
+        # the layout lists them.
+        if self.hotEntrypoints:
+            self.set_entry_points_layout(
+                entrypointLayout(self.entrypointNames(), ENTRYPOINT_WEIGHTS))
+
+    def error(self, message):
+        if self.errorCodes:
+            return sp.nat(ERROR_CODES[message])
+        return message
+
+    def entrypointNames(self):
+        # Whatever sp.entry_point wraps methods in, taken from an entrypoint
+        # of this class. Attributes are read from the class dictionaries,
+        # subclasses first, so inherited entrypoints are listed and
+        # overridden ones take the type of the override. The entrypoints of
+        # options are instance attributes, set by the add* methods.
+        entrypointType = type(vars(Escrow)["resetEscrow"])
+        attributes = dict(vars(self))
+        for klass in type(self).__mro__:
+            for name, value in vars(klass).items():
+                attributes.setdefault(name, value)
+        return sorted(name for name, value in attributes.items()
+                      if isinstance(value, entrypointType))
+
+    ### guards ###
+
+    def addSharedGuards(self):
+        errorType = sp.TNat if self.errorCodes else sp.TString
+        paramsType = sp.TRecord(party=sp.TOption(sp.TAddress), message=sp.TNat)
+
+        def messages(guard):
+            return sp.map({sp.nat(index): self.error(message)
+                           for index, message in enumerate(GUARD_MESSAGES[guard])},
+                          tkey=sp.TNat, tvalue=errorType)
+
+        def guardExists(self, transactionId):
+            sp.set_type(transactionId, self.keyType)
+            sp.verify(self.hasTransaction(transactionId),
+                      self.error("Transaction does not exist."))
+
+        def guardMaster(self, message):
+            sp.set_type(message, sp.TNat)
+            sp.verify(self.data.master == sp.sender, messages("master")[message])
+
+        # The owner and counterparty guards take the party, which callers
+        # read from the commission they have loaded.
+        def guardOwner(self, params):
+            sp.set_type(params, paramsType)
+            sp.verify(params.party == sp.some(sp.sender),
+                      messages("owner")[params.message])
+
+        def guardCounterparty(self, params):
+            sp.set_type(params, paramsType)
+            sp.verify(params.party == sp.some(sp.sender),
+                      messages("counterparty")[params.message])
+
+        readStorage = sp.private_lambda(with_storage="read-only", wrap_call=True)
+        withoutStorage = sp.private_lambda(wrap_call=True)
+        self.guardExists = readStorage(guardExists)
+        self.guardMaster = readStorage(guardMaster)
+        self.guardOwner = withoutStorage(guardOwner)
+        self.guardCounterparty = withoutStorage(guardCounterparty)
+
+    def verifyExists(self, transactionId):
+        if self.sharedGuards:
+            self.guardExists(transactionId)
+        else:
+            sp.verify(self.hasTransaction(transactionId),
+                      self.error("Transaction does not exist."))
+
+    def verifyMaster(self, message):
+        if self.sharedGuards:
+            self.guardMaster(sp.nat(GUARD_MESSAGES["master"].index(message)))
+        else:
+            sp.verify(self.data.master == sp.sender, self.error(message))
+
+    def verifyOwner(self, transactionId, message, transaction=None):
+        owner = self.partiesOf(transactionId, transaction).owner
+        if self.sharedGuards:
+            self.guardOwner(sp.record(
+                party=owner,
+                message=sp.nat(GUARD_MESSAGES["owner"].index(message))))
+        else:
+            sp.verify(owner == sp.some(sp.sender), self.error(message))
+
+    def verifyCounterparty(self, transactionId, message, transaction=None):
+        counterparty = self.partiesOf(transactionId, transaction).counterparty
+        if self.sharedGuards:
+            self.guardCounterparty(sp.record(
+                party=counterparty,
+                message=sp.nat(GUARD_MESSAGES["counterparty"].index(message))))
+        else:
+            sp.verify(counterparty == sp.some(sp.sender), self.error(message))
+
+    def verifyPending(self, transaction):
+        sp.verify(self.isStatus(transaction, 0),
+                  self.error("Transaction is not pending."))
+
+    ### aggregate counters ###
+
+    def emptyStats(self):
+        # totalLocked is the sum of the balances held by commissions. Credits
+        # owed under pullPayments are not part of it.
+        return sp.record(
+            pendingReverts=sp.nat(0),
+            totalLocked=sp.mutez(0),
+            **{counter: sp.nat(0) for counter in STATUS_COUNTERS.values()}
         )
 
+    def bump(self, counter, step):
+        if not self.stats:
+            return
+        if step > 0:
+            setattr(self.data.stats, counter,
+                    getattr(self.data.stats, counter) + 1)
+        else:
+            setattr(self.data.stats, counter,
+                    sp.as_nat(getattr(self.data.stats, counter) - 1))
+
+    def isPendingRevert(self, transaction):
+        # Both parties cancelled a commission that is neither completed nor
+        # reverted, which is what revertCommissionFunds requires.
+        return (self.hasWithdrawn(transaction, "owner") &
+                self.hasWithdrawn(transaction, "counterparty") &
+                self.isUnsettled(transaction))
+
+    def isUnsettled(self, transaction):
+        return ~self.isStatus(transaction, 2) & ~self.isStatus(transaction, -1)
+
+    def countStatus(self, transaction, step, status=None):
+        """Add `step` (1 or -1) to the counters `transaction` contributes to.
+        `status` skips the lookup when the status is known statically."""
+        if not self.stats:
+            return
+        if status is None:
+            for code, counter in STATUS_COUNTERS.items():
+                with sp.if_(self.isStatus(transaction, code)):
+                    self.bump(counter, step)
+        else:
+            self.bump(STATUS_COUNTERS[status], step)
+        with sp.if_(self.isPendingRevert(transaction)):
+            self.bump("pendingReverts", step)
+
+    def countTransaction(self, transaction, step):
+        self.countStatus(transaction, step)
+        self.countLocked(transaction.balanceOwner +
+                         transaction.balanceCounterparty, step)
+
+    def countLocked(self, amount, step):
+        if not self.stats:
+            return
+        if step > 0:
+            self.data.stats.totalLocked += amount
+        else:
+            self.data.stats.totalLocked -= amount
+
+    ### storage layout ###
+
+    def hasTransaction(self, transactionId):
+        if self.merged:
+            return self.data.commissions.contains(transactionId)
+        return self.data.transactions.contains(transactionId)
+
+    # partiesOf and detailsOf take the commission an entrypoint loaded, if
+    # any, as the layouts keeping those fields in its record must read and
+    # write them there.
+
+    def partiesOf(self, transactionId, transaction=None):
+        if self.merged:
+            if transaction is not None:
+                return transaction
+            return self.data.commissions[transactionId]
+        return self.data.parties[transactionId]
+
+    def transactionOf(self, transactionId):
+        if self.merged:
+            return self.data.commissions[transactionId]
+        return self.data.transactions[transactionId]
+
+    def detailsOf(self, transactionId, transaction=None):
+        if self.splitDetails:
+            return self.data.details[transactionId]
+        if transaction is not None:
+            return transaction
+        return self.transactionOf(transactionId)
+
+    def loadTransaction(self, transactionId):
+        """A local copy of the record of a commission. Entrypoints change
+        the copy and write it back with saveTransaction: a field of
+        transactionOf is a big_map lookup, and a field assignment a lookup
+        and an update, each deserializing the whole record."""
+        return sp.local("transaction", self.transactionOf(transactionId)).value
+
+    def saveTransaction(self, transactionId, transaction):
+        if self.merged:
+            self.data.commissions[transactionId] = transaction
+        else:
+            self.data.transactions[transactionId] = transaction
+
+    def saveParties(self, transactionId, transaction):
+        # For a loaded commission whose parties alone changed: setParty
+        # wrote them to `parties` unless they are part of the record.
+        if self.merged:
+            self.saveTransaction(transactionId, transaction)
+
+    def saveDetails(self, transactionId, transaction):
+        # For a loaded commission whose details alone changed: they were
+        # written to `details` if they are kept apart.
+        if not self.splitDetails:
+            self.saveTransaction(transactionId, transaction)
+
+    def storeTransaction(self, transactionId, parties, transaction):
+        if self.splitDetails:
+            self.data.details[transactionId] = sp.record(
+                **{name: transaction[name] for name in self.coldType})
+            transaction = {name: value for name, value in transaction.items()
+                           if name not in self.coldType}
+
+        if self.merged:
+            self.data.commissions[transactionId] = sp.record(
+                **parties, **transaction)
+        else:
+            self.data.parties[transactionId] = sp.record(**parties)
+            self.data.transactions[transactionId] = sp.record(**transaction)
+
+    def assignTransactionId(self, legacyId):
+        transactionId = sp.local("transactionId", self.data.nextId)
+        self.data.nextId += 1
+
+        with sp.if_(legacyId.is_some()):
+            sp.verify(~self.data.legacyIds.contains(legacyId.open_some()),
+                      self.error("Transaction already exists."))
+            self.data.legacyIds[legacyId.open_some()] = transactionId.value
+
+        return transactionId.value
+
+    def removeTransaction(self, transactionId, transaction):
+        self.countTransaction(transaction, -1)
+        if self.userIndex:
+            parties = self.partiesOf(transactionId, transaction)
+            with sp.if_(parties.owner.is_some()):
+                self.unindexParty(parties.owner.open_some(),
+                                  "owner", transactionId)
+            with sp.if_(parties.counterparty.is_some()):
+                self.unindexParty(parties.counterparty.open_some(),
+                                  "counterparty", transactionId)
+        if self.splitDetails:
+            del self.data.details[transactionId]
+        if self.merged:
+            del self.data.commissions[transactionId]
+        else:
+            del self.data.transactions[transactionId]
+            del self.data.parties[transactionId]
+
+    ### user index ###
+
+    def indexParty(self, party, role, transactionId):
+        with sp.if_(~self.data.userCommissions.contains(party)):
+            self.data.userCommissions[party] = sp.record(
+                owner=sp.set([], t=self.keyType),
+                counterparty=sp.set([], t=self.keyType),
+            )
+        getattr(self.data.userCommissions[party], role).add(transactionId)
+
+    def unindexParty(self, party, role, transactionId):
+        entry = self.data.userCommissions[party]
+        getattr(entry, role).remove(transactionId)
+        with sp.if_((sp.len(entry.owner) == 0) & (sp.len(entry.counterparty) == 0)):
+            del self.data.userCommissions[party]
+
+    def setParty(self, transactionId, role, party, transaction=None):
+        parties = self.partiesOf(transactionId, transaction)
+        if self.userIndex:
+            with sp.if_(getattr(parties, role).is_some()):
+                self.unindexParty(getattr(parties, role).open_some(),
+                                  role, transactionId)
+            with sp.if_(party.is_some()):
+                self.indexParty(party.open_some(), role, transactionId)
+        setattr(parties, role, party)
+
+    ### expiry queue ###
+
+    def expiryBucket(self, epoch):
+        return (epoch - sp.timestamp(0)) // EXPIRY_BUCKET_SECONDS
+
+    def scheduleExpiry(self, transactionId, epoch):
+        cursor = self.data.expiryCursor
+        bucket = sp.local("expiryBucket", self.expiryBucket(epoch))
+
+        with sp.if_(cursor.pending == 0):
+            with sp.if_(cursor.bucket != bucket.value):
+                del self.data.expiryCounts[cursor.bucket]
+            cursor.bucket = bucket.value
+            cursor.index = self.data.expiryCounts.get(bucket.value, sp.nat(0))
+        # Buckets behind the cursor are never visited again.
+        with sp.if_(bucket.value < cursor.bucket):
+            bucket.value = cursor.bucket
+
+        index = sp.local("expiryIndex", self.data.expiryCounts.get(
+            bucket.value, sp.nat(0)))
+        self.data.expiries[sp.pair(bucket.value, index.value)] = sp.record(
+            transactionId=transactionId,
+            epoch=epoch,
+        )
+        self.data.expiryCounts[bucket.value] = index.value + 1
+        cursor.pending += 1
+
+    def isSettleable(self, transactionId, transaction):
+        # What claimOwner requires besides the deadline, and a non-zero
+        # payout to send.
+        return (self.partiesOf(transactionId, transaction).owner.is_some() &
+                (transaction.balanceOwner == transaction.offer) &
+                (transaction.balanceCounterparty == transaction.fee) &
+                (transaction.balanceOwner + transaction.balanceCounterparty
+                 != sp.mutez(0)) &
+                ~self.hasWithdrawn(transaction, "owner"))
+
+    def rescheduleExpiry(self, transactionId, transaction):
+        # Queues the commission if sweepExpired could settle it. The admin
+        # setters may activate commissions without an owner or deposits,
+        # which are left to the admin.
+        if self.expiryQueue:
+            with sp.if_(self.isStatus(transaction, 1) &
+                        self.isSettleable(transactionId, transaction)):
+                self.scheduleExpiry(transactionId, transaction.epoch)
+
+    def activate(self, transactionId, transaction):
+        transaction.epoch = sp.now.add_seconds(sp.to_int(transaction.duration))
+        self.setStatus(transaction, 1, previous=[0])
+        self.rescheduleExpiry(transactionId, transaction)
+
+    def activateIfFunded(self, transactionId, transaction):
+        if self.autoActivate:
+            with sp.if_((transaction.balanceOwner == transaction.offer) &
+                        (transaction.balanceCounterparty == transaction.fee) &
+                        self.partiesOf(transactionId, transaction).counterparty.is_some()):
+                self.activate(transactionId, transaction)
+
+    ### lifecycle state ###
+
+    def isStatus(self, transaction, status):
+        if self.packedStatus:
+            return (transaction.state & sp.nat(3)) == sp.nat(STATUS_BITS[status])
+        return transaction.status == sp.int(status)
+
+    def statusOf(self, transaction):
+        if self.packedStatus:
+            bits = transaction.state & sp.nat(3)
+            return sp.eif(bits == sp.nat(STATUS_BITS[-1]), sp.int(-1), sp.to_int(bits))
+        return transaction.status
+
+    def setStatus(self, transaction, status, previous=None):
+        """Move `transaction` to `status`. `previous` lists the statuses it
+        can be in, which skips the lookups of the others and the
+        pending-revert check; only the admin setters, which may move a
+        commission from any status, leave it out. A commission moving to -1
+        this way must be pending a revert, as revert requires, and one
+        moving to 2 must not be, as settle requires."""
+        if previous is None:
+            self.countStatus(transaction, -1)
+        elif len(previous) == 1:
+            self.bump(STATUS_COUNTERS[previous[0]], -1)
+        else:
+            for code in previous:
+                with sp.if_(self.isStatus(transaction, code)):
+                    self.bump(STATUS_COUNTERS[code], -1)
+        if previous is not None and status == -1:
+            self.bump("pendingReverts", -1)
+        if self.packedStatus:
+            transaction.state = ((transaction.state >> 2) << 2) | sp.nat(STATUS_BITS[status])
+        else:
+            transaction.status = sp.int(status)
+        if previous is None:
+            self.countStatus(transaction, 1, status)
+        else:
+            self.bump(STATUS_COUNTERS[status], 1)
+
+    def assignStatus(self, transaction, status):
+        self.countStatus(transaction, -1)
+        if self.packedStatus:
+            sp.verify((status >= -1) & (status <= 2), self.error("Unknown status."))
+            with sp.if_(status == -1):
+                transaction.state = ((transaction.state >> 2) << 2) | sp.nat(STATUS_BITS[-1])
+            with sp.else_():
+                transaction.state = ((transaction.state >> 2) << 2) | sp.as_nat(status)
+        else:
+            transaction.status = status
+        self.countStatus(transaction, 1)
+
+    def hasWithdrawn(self, transaction, party):
+        if self.packedStatus:
+            return (transaction.state & sp.nat(WITHDRAWN_BITS[party])) != sp.nat(0)
+        return getattr(transaction, party + "HasWithdrawn")
+
+    def toggleWithdrawn(self, transaction, party):
+        if self.stats:
+            with sp.if_(self.isPendingRevert(transaction)):
+                self.bump("pendingReverts", -1)
+            with sp.else_():
+                other = "counterparty" if party == "owner" else "owner"
+                with sp.if_(~self.hasWithdrawn(transaction, party) &
+                            self.hasWithdrawn(transaction, other) &
+                            self.isUnsettled(transaction)):
+                    self.bump("pendingReverts", 1)
+        if self.packedStatus:
+            transaction.state = transaction.state ^ sp.nat(WITHDRAWN_BITS[party])
+        else:
+            setattr(transaction, party + "HasWithdrawn",
+                    ~getattr(transaction, party + "HasWithdrawn"))
+
     @sp.entry_point
     def resetEscrow(self):
-        sp.verify(self.data.master == sp.sender, "Only the admin can reset!")
-        self.data.transactions = sp.big_map({})
-        self.data.parties = sp.big_map({})
-
-    def initTransaction(self, transactionId, offer=sp.mutez(0), fee=sp.mutez(0), duration=sp.nat(0), epoch=sp.timestamp(0), secret=sp.string("secret_key"), description=sp.string("description"), title=sp.string("title")):
-        self.data.transactions[transactionId] = sp.record(
+        self.verifyMaster("Only the admin can reset!")
+        if self.merged:
+            self.data.commissions = sp.big_map({})
+        else:
+            self.data.transactions = sp.big_map({})
+            self.data.parties = sp.big_map({})
+        if self.splitDetails:
+            self.data.details = sp.big_map({})
+        if self.userIndex:
+            self.data.userCommissions = sp.big_map({})
+        if self.expiryQueue:
+            self.data.expiries = sp.big_map({})
+            self.data.expiryCounts = sp.big_map({})
+            self.data.expiryCursor = sp.record(
+                bucket=sp.int(0), index=sp.nat(0), pending=sp.nat(0))
+        if self.revertQueue:
+            self.data.revertQueue = sp.big_map({})
+            self.data.revertCursor = sp.record(head=sp.nat(0), tail=sp.nat(0))
+            self.data.revertQueued = sp.big_map({})
+        if self.counterIds:
+            # Keys are assigned from 0 again. String IDs of the cleared
+            # commissions only resolve off-chain, from the operations that
+            # posted or migrated them.
+            self.data.nextId = 0
+            self.data.legacyIds = sp.big_map({})
+        if self.stats:
+            self.data.stats = self.emptyStats()
+
+    def initTransaction(self, transactionId, owner=sp.none, offer=sp.mutez(0), fee=sp.mutez(0), duration=sp.nat(0), epoch=sp.timestamp(0), secret=sp.string("secret_key"), hashedSecret=None, description=sp.string("description"), title=sp.string("title"), metadataHash=sp.bytes("0x"), metadataUri=sp.string(""), balanceOwner=sp.mutez(0)):
+        if not self.counterIds:
+            sp.verify(~self.hasTransaction(transactionId),
+                      self.error("Transaction already exists."))
+
+        transaction = dict(
             offer=offer,
             fee=fee,
-            balanceOwner=sp.mutez(0),
+            balanceOwner=balanceOwner,
             balanceCounterparty=sp.mutez(0),
             epoch=epoch,
             duration=duration,
-            hashedSecret=sp.some(sp.blake2b(sp.pack(secret))),
-            ownerHasWithdrawn=sp.bool(False),
-            counterpartyHasWithdrawn=sp.bool(False),
-            description=description,
-            title=title,
-            status=sp.int(0),
+            hashedSecret=sp.some(sp.blake2b(sp.pack(secret))
+                                 if hashedSecret is None else hashedSecret),
+        )
+        if self.offchainMetadata:
+            transaction.update(metadataHash=metadataHash,
+                               metadataUri=metadataUri)
+        else:
+            transaction.update(description=description, title=title)
+        if self.packedStatus:
+            transaction.update(state=sp.nat(0))
+        else:
+            transaction.update(
+                ownerHasWithdrawn=sp.bool(False),
+                counterpartyHasWithdrawn=sp.bool(False),
+                status=sp.int(0),
+            )
+
+        self.storeTransaction(
+            transactionId,
+            dict(
+                owner=owner,
+                counterparty=sp.none,
+            ),
+            transaction,
         )
+        self.bump(STATUS_COUNTERS[0], 1)
 
     ### main admin interfaces ###
 
     @sp.entry_point
     def createCommission(self, transactionId=sp.none):
-        sp.verify(self.data.master == sp.sender,
-                  "Only the admin can create a transaction!")
-
-        with sp.if_(transactionId == sp.none):
-            newTransaction = str(uuid.uuid4())
-            self.initTransaction(newTransaction)
-            self.data.parties[newTransaction] = sp.record(
-                owner=sp.none,
-                counterparty=sp.none,
-            )
-        with sp.else_():
-            self.initTransaction(transactionId.open_some())
-            self.data.parties[transactionId.open_some()] = sp.record(
-                owner=sp.none,
-                counterparty=sp.none,
-            )
-
-    @sp.entry_point
+        self.verifyMaster("Only the admin can create a transaction!")
+
+        if self.counterIds:
+            self.initTransaction(self.assignTransactionId(transactionId))
+        else:
+            with sp.if_(transactionId == sp.none):
+                newTransaction = str(uuid.uuid4())
+                self.initTransaction(newTransaction)
+            with sp.else_():
+                self.initTransaction(transactionId.open_some())
+
+    def openCommission(self, transactionId, offer, fee, duration, hashedSecret, deposit=False, **details):
+        # A deposit is stored with the new record: the commission has no
+        # counterparty yet, so there is nothing else creditOwner would do.
+        self.initTransaction(transactionId, owner=sp.some(sp.sender), offer=offer, fee=fee,
+                             duration=duration, hashedSecret=hashedSecret,
+                             balanceOwner=offer if deposit else sp.mutez(0), **details)
+        if self.userIndex:
+            self.indexParty(sp.sender, "owner", transactionId)
+        if deposit:
+            sp.verify(sp.amount == offer,
+                      self.error("Amount does not match offer."))
+            self.countLocked(offer, 1)
+
+    def postTransaction(self, transactionId, offer, fee, duration, secret, deposit=False, **details):
+        hashedSecret = sp.blake2b(sp.pack(secret))
+        if self.counterIds:
+            self.openCommission(self.assignTransactionId(transactionId), offer, fee,
+                                duration, hashedSecret, deposit, **details)
+        else:
+            with sp.if_(transactionId == sp.none):
+                newTransactionId = str(uuid.uuid4())
+                self.openCommission(newTransactionId, offer, fee,
+                                    duration, hashedSecret, deposit, **details)
+
+            with sp.else_():
+                self.openCommission(transactionId.open_some(), offer, fee,
+                                    duration, hashedSecret, deposit, **details)
+
+    def verifyMetadata(self, metadataHash, metadataUri):
+        sp.verify(sp.len(metadataHash) == METADATA_HASH_LENGTH,
+                  self.error("Metadata hash must be 32 bytes."))
+        sp.verify(sp.len(metadataUri) <= MAX_METADATA_URI_LENGTH,
+                  self.error("Metadata URI is too long."))
+
+    @sp.entry_point(lazify=False)
     def postCommission(self, offer, fee, duration, secret, description, title, transactionId=sp.none):
 
         sp.set_type(offer, sp.TMutez)
@@ -86,32 +918,118 @@ class Escrow(sp.Contract):
         sp.set_type(description, sp.TString)
         sp.set_type(title, sp.TString)
 
-        with sp.if_(transactionId == sp.none):
-            newTransactionId = str(uuid.uuid4())
-            self.initTransaction(newTransactionId, offer=offer,
-                                 fee=fee, secret=secret, description=description, title=title)
-            self.data.parties[newTransactionId] = sp.record(
-                owner=sp.some(sp.sender),
-                counterparty=sp.none,
-            )
+        if self.offchainMetadata:
+            sp.failwith(self.error("Commission details are stored off-chain."))
+        else:
+            self.postTransaction(transactionId, offer, fee, duration, secret,
+                                 description=description, title=title)
 
-        with sp.else_():
-            self.initTransaction(transactionId.open_some(), offer=offer,
-                                 fee=fee, secret=secret, description=description, title=title, duration=duration)
-            self.data.parties[transactionId.open_some()] = sp.record(
-                owner=sp.some(sp.sender),
-                counterparty=sp.none,
-            )
+    @sp.entry_point(lazify=False)
+    def postAndDeposit(self, offer, fee, duration, secret, description, title, transactionId=sp.none):
+        # postCommission followed by depositOwner: the offer is attached to
+        # the post.
+        sp.set_type(offer, sp.TMutez)
+        sp.set_type(fee, sp.TMutez)
+        sp.set_type(duration, sp.TNat)
+        sp.set_type(secret, sp.TString)
+        sp.set_type(description, sp.TString)
+        sp.set_type(title, sp.TString)
+
+        if self.offchainMetadata:
+            sp.failwith(self.error("Commission details are stored off-chain."))
+        else:
+            self.postTransaction(transactionId, offer, fee, duration, secret,
+                                 deposit=True, description=description, title=title)
+
+    def addMetadataEntrypoints(self):
+        def postCommissionMetadata(self, offer, fee, duration, secret, metadataHash, metadataUri, transactionId=sp.none):
+            sp.set_type(offer, sp.TMutez)
+            sp.set_type(fee, sp.TMutez)
+            sp.set_type(duration, sp.TNat)
+            sp.set_type(secret, sp.TString)
+            sp.set_type(metadataHash, sp.TBytes)
+            sp.set_type(metadataUri, sp.TString)
+
+            self.verifyMetadata(metadataHash, metadataUri)
+            self.postTransaction(transactionId, offer, fee, duration, secret,
+                                 metadataHash=metadataHash, metadataUri=metadataUri)
+
+        def editCommissionMetadata(self, transactionId, metadataHash, metadataUri):
+            sp.set_type(transactionId, self.keyType)
+            sp.set_type(metadataHash, sp.TBytes)
+            sp.set_type(metadataUri, sp.TString)
+
+            self.verifyExists(transactionId)
+            transaction = self.loadTransaction(transactionId)
+            self.verifyOwner(transactionId, "Only the owner can edit the commission details.",
+                             transaction)
+            self.verifyPending(transaction)
+
+            self.verifyMetadata(metadataHash, metadataUri)
+            details = self.detailsOf(transactionId, transaction)
+            details.metadataHash = metadataHash
+            details.metadataUri = metadataUri
+            self.saveDetails(transactionId, transaction)
+
+        self.postCommissionMetadata = sp.entry_point(lazify=False)(postCommissionMetadata)
+        self.editCommissionMetadata = sp.entry_point(editCommissionMetadata)
 
     @sp.entry_point
-    def setCommissionDetails(self, owner, transactionId, counterparty, duration, offer, fee, secret, description, title):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
+    def postCommissions(self, commissions):
+        # With counter keys the ID of each commission is an optional legacy
+        # alias, as in postCommission. Secrets are given hashed, as in
+        # setTransactionHashedSecret, so the batch does not publish them.
+        sp.set_type(commissions, sp.TList(sp.TRecord(
+            transactionId=sp.TOption(sp.TString) if self.counterIds else sp.TString,
+            offer=sp.TMutez,
+            fee=sp.TMutez,
+            duration=sp.TNat,
+            hashedSecret=sp.TBytes,
+            **self.detailsType,
+        )))
+
+        with sp.for_("commission", commissions) as commission:
+            transactionId = commission.transactionId
+            if self.counterIds:
+                transactionId = self.assignTransactionId(transactionId)
+            if self.offchainMetadata:
+                self.verifyMetadata(commission.metadataHash,
+                                    commission.metadataUri)
+            self.openCommission(transactionId, commission.offer, commission.fee,
+                                commission.duration, commission.hashedSecret,
+                                **{name: getattr(commission, name) for name in self.detailsType})
+
+    def addMigrateCommission(self):
+        def migrateCommission(self, legacyId, owner, counterparty, transaction):
+            sp.set_type(legacyId, sp.TString)
+            sp.set_type(owner, sp.TOption(sp.TAddress))
+            sp.set_type(counterparty, sp.TOption(sp.TAddress))
+            sp.set_type(transaction, sp.TRecord(**self.transactionType))
+
+            self.verifyMaster("Only the admin can migrate a commission.")
+            sp.verify(sp.amount == transaction.balanceOwner + transaction.balanceCounterparty,
+                      self.error("Amount does not match the migrated balances."))
+
+            transactionId = self.assignTransactionId(sp.some(legacyId))
+            self.storeTransaction(
+                transactionId,
+                dict(owner=owner, counterparty=counterparty),
+                {name: getattr(transaction, name)
+                 for name in self.transactionType},
+            )
+            if self.userIndex:
+                with sp.if_(owner.is_some()):
+                    self.indexParty(owner.open_some(), "owner", transactionId)
+                with sp.if_(counterparty.is_some()):
+                    self.indexParty(counterparty.open_some(),
+                                    "counterparty", transactionId)
+            self.countTransaction(transaction, 1)
 
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
+        self.migrateCommission = sp.entry_point(migrateCommission)
 
+    @sp.entry_point
+    def setCommissionDetails(self, owner, transactionId, counterparty, duration, offer, fee, secret, description, title):
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(owner, sp.TAddress)
         sp.set_type(counterparty, sp.TAddress)
         sp.set_type(duration, sp.TNat)
@@ -121,475 +1039,739 @@ class Escrow(sp.Contract):
         sp.set_type(description, sp.TString)
         sp.set_type(title, sp.TString)
 
-        self.data.parties[transactionId].owner = sp.some(
-            owner)
-        self.data.parties[transactionId].counterparty = sp.some(
-            counterparty)
-
-        transaction = self.data.transactions[transactionId]
+        if self.offchainMetadata:
+            # There is no title or description to set: commissions of this
+            # layout get their details through postCommissionMetadata.
+            sp.failwith(self.error("Commission details are stored off-chain."))
+        else:
+            self.verifyExists(transactionId)
+            self.verifyMaster("Only admin can set transaction details.")
+
+            transaction = self.loadTransaction(transactionId)
+            self.setParty(transactionId, "owner", sp.some(owner), transaction)
+            self.setParty(transactionId, "counterparty", sp.some(counterparty),
+                          transaction)
+
+            transaction.duration = duration
+            transaction.offer = offer
+            transaction.fee = fee
+            self.setStatus(transaction, 1)
+            self.rescheduleExpiry(transactionId, transaction)
+
+            details = self.detailsOf(transactionId, transaction)
+            details.hashedSecret = sp.some(
+                sp.blake2b(sp.pack(secret)))
+            details.description = description
+            details.title = title
+            self.saveTransaction(transactionId, transaction)
+
+    def verifyAdminUpdate(self, transactionId):
+        self.verifyExists(transactionId)
+        self.verifyMaster("Only admin can set transaction details.")
+
+    def applyUpdate(self, transactionId, transaction, field, value):
+        # `transaction` is the loaded commission, or None for the fields
+        # setParty and detailsOf can write to storage directly.
+        if field in ("owner", "counterparty"):
+            self.setParty(transactionId, field, sp.some(value), transaction)
+        elif field == "secret":
+            self.detailsOf(transactionId, transaction).hashedSecret = sp.some(
+                sp.blake2b(sp.pack(value)))
+        elif field == "status":
+            self.assignStatus(transaction, value)
+            self.rescheduleExpiry(transactionId, transaction)
+        else:
+            setattr(transaction, field, value)
+            if field == "epoch":
+                self.rescheduleExpiry(transactionId, transaction)
+
+    def updateTransaction(self, transactionId, field, value):
+        if field in ("owner", "counterparty", "secret"):
+            self.applyUpdate(transactionId, None, field, value)
+        else:
+            transaction = self.loadTransaction(transactionId)
+            self.applyUpdate(transactionId, transaction, field, value)
+            self.saveTransaction(transactionId, transaction)
 
-        transaction.duration = duration
-        transaction.offer = offer
-        transaction.fee = fee
-        transaction.hashedSecret = sp.some(
-            sp.blake2b(sp.pack(secret)))
-        transaction.description = description
-        transaction.title = title
-        transaction.status = sp.int(1)
+    @sp.entry_point
+    def updateTransactions(self, transactions):
+        sp.set_type(transactions, sp.TList(sp.TRecord(
+            transactionId=self.keyType,
+            updates=sp.TList(TTransactionUpdate),
+        )))
+        self.verifyMaster("Only admin can set transaction details.")
+
+        with sp.for_("commission", transactions) as commission:
+            self.verifyExists(commission.transactionId)
+            transaction = self.loadTransaction(commission.transactionId)
+            with sp.for_("update", commission.updates) as update:
+                with update.match_cases() as arg:
+                    for field in TRANSACTION_UPDATES:
+                        with arg.match(field) as value:
+                            self.applyUpdate(commission.transactionId,
+                                             transaction, field, value)
+            self.saveTransaction(commission.transactionId, transaction)
 
     @sp.entry_point
     def setCommissionStatus(self, transactionId, status):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
-        transaction = self.data.transactions[transactionId]
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(status, sp.TInt)
-        transaction.status = status
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "status", status)
 
     @sp.entry_point
     def setTransactionEpoch(self, transactionId, epoch):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(epoch, sp.TTimestamp)
-
-        self.data.transactions[transactionId].epoch = epoch
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "epoch", epoch)
 
     @sp.entry_point
     def setTransactionDuration(self, transactionId, duration):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(duration, sp.TNat)
-
-        self.data.transactions[transactionId].duration = duration
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "duration", duration)
 
     @sp.entry_point
     def setCommissionParticipants(self, transactionId, owner, counterparty):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-        sp.verify(self.data.parties[transactionId].owner == sp.none,
-                  "Owner already set.")
-        sp.verify(self.data.parties[transactionId].counterparty == sp.none,
-                  "Counterparty already set.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyAdminUpdate(transactionId)
+        # Only the merged layout keeps the parties in the record.
+        transaction = self.loadTransaction(transactionId) if self.merged else None
+        parties = self.partiesOf(transactionId, transaction)
+        sp.verify(parties.owner == sp.none,
+                  self.error("Owner already set."))
+        sp.verify(parties.counterparty == sp.none,
+                  self.error("Counterparty already set."))
 
         sp.set_type(owner, sp.TAddress)
         sp.set_type(counterparty, sp.TAddress)
 
-        self.data.parties[transactionId].owner = sp.some(
-            owner)
-        self.data.parties[transactionId].counterparty = sp.some(
-            counterparty)
+        self.applyUpdate(transactionId, transaction, "owner", owner)
+        self.applyUpdate(transactionId, transaction, "counterparty", counterparty)
+        self.saveParties(transactionId, transaction)
 
     @sp.entry_point
     def setTransactionOwner(self, transactionId, owner):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(owner, sp.TAddress)
-
-        self.data.parties[transactionId].owner = sp.some(
-            owner)
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "owner", owner)
 
     @sp.entry_point
     def setTransactionCounterparty(self, transactionId, counterparty):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(counterparty, sp.TAddress)
-
-        self.data.parties[transactionId].counterparty = sp.some(
-            counterparty)
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "counterparty", counterparty)
 
     @sp.entry_point
     def setTransactionFromOwner(self, transactionId, offer):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(offer, sp.TMutez)
-
-        self.data.transactions[transactionId].offer = offer
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "offer", offer)
 
     @sp.entry_point
     def setTransactionFromCounterparty(self, transactionId, fee):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(fee, sp.TMutez)
-
-        self.data.transactions[transactionId].fee = fee
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "fee", fee)
 
     @sp.entry_point
     def setTransactionHashedSecret(self, transactionId, secret):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        sp.verify(sp.sender == self.data.master,
-                  "Only admin can set transaction details.")
-
+        sp.set_type(transactionId, self.keyType)
         sp.set_type(secret, sp.TString)
-
-        self.data.transactions[transactionId].hashedSecret = sp.some(
-            sp.blake2b(sp.pack(secret)))
+        self.verifyAdminUpdate(transactionId)
+        self.updateTransaction(transactionId, "secret", secret)
 
     @ sp.entry_point
     def revertCommissionFunds(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.master == sp.sender,
-                  "Only the admin can revert the commission funds.")
-
-        transaction = self.data.transactions[transactionId]
-
-        sp.verify(transaction.ownerHasWithdrawn == sp.bool(True),
-                  "Owner did not cancel the commission.")
-        sp.verify(transaction.counterpartyHasWithdrawn == sp.bool(True),
-                  "Counterparty did not cancel the commission.")
-        sp.verify(transaction.status != sp.int(2),
-                  "Transaction has already been completed.")
-        sp.verify(transaction.status != sp.int(-1),
-                  "Transaction has already been reverted.")
-
-        sp.send(self.data.parties[transactionId].owner.open_some(
-        ), transaction.offer)
-        sp.send(self.data.parties[transactionId].counterparty.open_some(
-        ), transaction.fee)
-
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        self.verifyMaster("Only the admin can revert the commission funds.")
+
+        transaction = self.loadTransaction(transactionId)
+
+        sp.verify(self.hasWithdrawn(transaction, "owner"),
+                  self.error("Owner did not cancel the commission."))
+        sp.verify(self.hasWithdrawn(transaction, "counterparty"),
+                  self.error("Counterparty did not cancel the commission."))
+        sp.verify(~self.isStatus(transaction, 2),
+                  self.error("Transaction has already been completed."))
+        sp.verify(~self.isStatus(transaction, -1),
+                  self.error("Transaction has already been reverted."))
+
+        self.revert(transactionId, transaction)
+        self.saveTransaction(transactionId, transaction)
+
+    def revert(self, transactionId, transaction):
+        parties = self.partiesOf(transactionId, transaction)
+        self.payout(parties.owner.open_some(), transaction.offer)
+        self.payout(parties.counterparty.open_some(), transaction.fee)
+
+        self.countLocked(transaction.balanceOwner +
+                         transaction.balanceCounterparty, -1)
         transaction.balanceOwner = sp.mutez(0)
         transaction.balanceCounterparty = sp.mutez(0)
-        transaction.status = sp.int(-1)
+        # Only commissions pending a revert, hence neither completed nor
+        # reverted, are reverted.
+        self.setStatus(transaction, -1, previous=[0, 1])
+
+    def cancel(self, transactionId, transaction, party):
+        self.toggleWithdrawn(transaction, party)
+        if party == "owner":
+            # The sweep drops the entry of a commission the owner cancelled.
+            self.rescheduleExpiry(transactionId, transaction)
+
+        if self.autoRefund or self.revertQueue:
+            with sp.if_(self.isPendingRevert(transaction)):
+                if self.autoRefund:
+                    self.revert(transactionId, transaction)
+                else:
+                    # Cancellations withdrawn and made again while the
+                    # commission is queued do not queue it twice.
+                    with sp.if_(~self.data.revertQueued.contains(transactionId)):
+                        cursor = self.data.revertCursor
+                        self.data.revertQueue[cursor.tail] = transactionId
+                        self.data.revertQueued[transactionId] = sp.unit
+                        cursor.tail += 1
+
+    def addProcessReverts(self):
+        def processReverts(self, limit):
+            # Reverts up to `limit` queued commissions, oldest first, crediting
+            # the parties. Entries of commissions that are no longer pending a
+            # revert are dropped.
+            sp.set_type(limit, sp.TNat)
+            self.verifyMaster("Only the admin can revert the commission funds.")
+
+            cursor = self.data.revertCursor
+            end = sp.local("end", sp.min(cursor.tail, cursor.head + limit))
+            with sp.while_(cursor.head < end.value):
+                transactionId = sp.local(
+                    "transactionId", self.data.revertQueue[cursor.head])
+                del self.data.revertQueue[cursor.head]
+                del self.data.revertQueued[transactionId.value]
+                cursor.head += 1
+
+                with sp.if_(self.hasTransaction(transactionId.value)):
+                    transaction = self.loadTransaction(transactionId.value)
+                    with sp.if_(self.isPendingRevert(transaction)):
+                        self.revert(transactionId.value, transaction)
+                        self.saveTransaction(transactionId.value, transaction)
+
+        self.processReverts = sp.entry_point(processReverts)
 
     ### OWNER INTERFACES ###
 
     @sp.entry_point
     def activateCommission(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == self.data.parties[transactionId].owner.open_some(),
-                  "Only owner can start transaction.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        sp.verify(sp.sender == self.partiesOf(transactionId, transaction).owner.open_some(),
+                  self.error("Only owner can start transaction."))
+
+        self.verifyPending(transaction)
         sp.verify((transaction.balanceOwner != sp.mutez(0)) & (transaction.balanceCounterparty != sp.mutez(0)),
-                  "Both parties must deposit first!")
+                  self.error("Both parties must deposit first!"))
 
-        transaction.epoch = sp.now.add_seconds(sp.to_int(transaction.duration))
-        transaction.status = sp.int(1)
+        self.activate(transactionId, transaction)
+        self.saveTransaction(transactionId, transaction)
 
     @sp.entry_point
     def editCommisionReward(self, transactionId, newFromOwner):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can edit the commission reward.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can edit the commission reward.",
+                         transaction)
+        self.verifyPending(transaction)
         sp.verify(transaction.balanceOwner == sp.mutez(0),
-                  "Owner has already deposited.")
+                  self.error("Owner has already deposited."))
 
         sp.set_type(newFromOwner, sp.TMutez)
         transaction.offer = newFromOwner
+        self.saveTransaction(transactionId, transaction)
 
     @sp.entry_point
     def editCommisionFee(self, transactionId, newFromCounterparty):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can edit the commission fee.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can edit the commission fee.",
+                         transaction)
+        self.verifyPending(transaction)
         sp.verify(transaction.balanceCounterparty == sp.mutez(0),
-                  "Counterparty has already deposited.")
+                  self.error("Counterparty has already deposited."))
 
         sp.set_type(newFromCounterparty, sp.TMutez)
         transaction.fee = newFromCounterparty
+        self.saveTransaction(transactionId, transaction)
 
     @sp.entry_point
     def editCommisionDetails(self, transactionId, newDetails):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can edit the commission details.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can edit the commission details.",
+                         transaction)
+        self.verifyPending(transaction)
 
         sp.set_type(newDetails, sp.TString)
-        transaction.description = newDetails
+        if self.offchainMetadata:
+            sp.failwith(self.error("Commission details are stored off-chain."))
+        else:
+            self.detailsOf(transactionId, transaction).description = newDetails
+            self.saveDetails(transactionId, transaction)
 
     @sp.entry_point
     def editCommisionDuration(self, transactionId, newDuration):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can edit the commission description.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can edit the commission description.",
+                         transaction)
+        self.verifyPending(transaction)
 
         sp.set_type(newDuration, sp.TNat)
         transaction.duration = newDuration
+        self.saveTransaction(transactionId, transaction)
 
     @sp.entry_point
     def editCommisionSecret(self, transactionId, newSecret):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can edit the commission details.")
-
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can edit the commission details.",
+                         transaction)
+        self.verifyPending(transaction)
 
         sp.set_type(newSecret, sp.TString)
-        transaction.hashedSecret = sp.some(sp.blake2b(sp.pack(newSecret)))
+        self.detailsOf(transactionId, transaction).hashedSecret = sp.some(
+            sp.blake2b(sp.pack(newSecret)))
+        self.saveDetails(transactionId, transaction)
 
     @ sp.entry_point
     def cancelCommissionOwner(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can cancel the commission.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can cancel the commission.",
+                         transaction)
 
-        self.data.transactions[transactionId].ownerHasWithdrawn = ~self.data.transactions[transactionId].ownerHasWithdrawn
+        self.cancel(transactionId, transaction, "owner")
+        self.saveTransaction(transactionId, transaction)
 
     @ sp.entry_point
     def deleteCommission(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can delete the commission.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyOwner(transactionId, "Only the owner can delete the commission.",
+                         transaction)
 
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status != sp.int(0),
-                  "Transaction is not pending.")
+        sp.verify(~self.isStatus(transaction, 0),
+                  self.error("Transaction is not pending."))
 
         with sp.if_(transaction.balanceOwner != sp.mutez(0)):
-            sp.send(sp.sender, transaction.balanceOwner, sp.tez(0))
-
-        del self.data.transactions[transactionId]
-        del self.data.parties[transactionId]
-
-    @sp.entry_point
-    def depositOwner(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
+            self.payout(sp.sender, transaction.balanceOwner)
 
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
-        sp.verify(self.data.parties[transactionId].owner == sp.some(sp.sender),
-                  "Only the owner can deposit funds.")
+        self.removeTransaction(transactionId, transaction)
 
-        transaction = self.data.transactions[transactionId]
+    def creditOwner(self, transactionId, transaction, amount=None):
+        self.verifyPending(transaction)
+        self.verifyOwner(transactionId, "Only the owner can deposit funds.",
+                         transaction)
         sp.verify(transaction.balanceOwner == sp.tez(0),
-                  "Owner already deposited funds.")
-        sp.verify(sp.amount == transaction.offer,
-                  "Amount does not match offer.")
+                  self.error("Owner already deposited funds."))
+        if amount is not None:
+            sp.verify(amount == transaction.offer,
+                      self.error("Amount does not match offer."))
 
-        transaction.balanceOwner += sp.amount
+        transaction.balanceOwner += transaction.offer
+        self.countLocked(transaction.offer, 1)
+        self.activateIfFunded(transactionId, transaction)
+
+    @sp.entry_point(lazify=False)
+    def depositOwner(self, transactionId):
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.creditOwner(transactionId, transaction, sp.amount)
+        self.saveTransaction(transactionId, transaction)
+
+    @sp.entry_point(lazify=False)
+    def depositOwnerBatch(self, transactionIds):
+        sp.set_type(transactionIds, sp.TList(self.keyType))
+
+        total = sp.local("total", sp.mutez(0))
+        with sp.for_("transactionId", transactionIds) as transactionId:
+            self.verifyExists(transactionId)
+            transaction = self.loadTransaction(transactionId)
+            self.creditOwner(transactionId, transaction)
+            total.value += transaction.offer
+            self.saveTransaction(transactionId, transaction)
+
+        sp.verify(sp.amount == total.value,
+                  self.error("Amount does not match the total offer."))
 
     ### COUNTERPARTY INTERFACES ###
 
-    @ sp.entry_point
-    def acceptCommission(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].counterparty == sp.none,
-                  "Transaction already has a counterparty.")
+    def accept(self, transactionId, transaction):
+        sp.verify(self.partiesOf(transactionId, transaction).counterparty == sp.none,
+                  self.error("Transaction already has a counterparty."))
+        self.verifyPending(transaction)
 
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        self.setParty(transactionId, "counterparty", sp.some(sp.sender),
+                      transaction)
 
-        self.data.parties[transactionId].counterparty = sp.some(
-            sp.sender)
+    @sp.entry_point(lazify=False)
+    def acceptCommission(self, transactionId):
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.accept(transactionId, transaction)
+        self.saveParties(transactionId, transaction)
+
+    @sp.entry_point(lazify=False)
+    def acceptAndDeposit(self, transactionId):
+        # acceptCommission followed by depositCounterparty: the fee is
+        # attached to the acceptance.
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.accept(transactionId, transaction)
+        self.creditCounterparty(transactionId, transaction, sp.amount)
+        self.saveTransaction(transactionId, transaction)
 
     @ sp.entry_point
     def cancelCommissionCounterparty(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(self.data.parties[transactionId].counterparty == sp.some(sp.sender),
-                  "Only the counterparty can cancel the commission.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.verifyCounterparty(transactionId, "Only the counterparty can cancel the commission.",
+                                transaction)
 
-        transaction = self.data.transactions[transactionId]
         sp.verify((transaction.balanceOwner != sp.tez(0)) & (transaction.balanceCounterparty != sp.tez(0)),
-                  "Nobody has deposited funds yet. Leave the commission instead.")
+                  self.error("Nobody has deposited funds yet. Leave the commission instead."))
 
-        transaction.counterpartyHasWithdrawn = ~transaction.counterpartyHasWithdrawn
+        self.cancel(transactionId, transaction, "counterparty")
+        self.saveTransaction(transactionId, transaction)
 
-    @sp.entry_point
-    def depositCounterparty(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-
-        transaction = self.data.transactions[transactionId]
-        party = self.data.parties[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
-        sp.verify(party.counterparty == sp.some(sp.sender),
-                  "Only the counterparty can deposit funds.")
+    def creditCounterparty(self, transactionId, transaction, amount=None):
+        self.verifyPending(transaction)
+        self.verifyCounterparty(transactionId, "Only the counterparty can deposit funds.",
+                                transaction)
         sp.verify(transaction.balanceCounterparty == sp.tez(0),
-                  "Counterparty already deposited funds.")
-        sp.verify(sp.amount == transaction.fee,
-                  "Amount does not match fee.")
+                  self.error("Counterparty already deposited funds."))
+        if amount is not None:
+            sp.verify(amount == transaction.fee,
+                      self.error("Amount does not match fee."))
+
+        transaction.balanceCounterparty += transaction.fee
+        self.countLocked(transaction.fee, 1)
+        self.activateIfFunded(transactionId, transaction)
 
-        self.data.transactions[transactionId].balanceCounterparty += sp.amount
+    @sp.entry_point(lazify=False)
+    def depositCounterparty(self, transactionId):
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        self.creditCounterparty(transactionId, transaction, sp.amount)
+        self.saveTransaction(transactionId, transaction)
+
+    @sp.entry_point(lazify=False)
+    def depositCounterpartyBatch(self, transactionIds):
+        sp.set_type(transactionIds, sp.TList(self.keyType))
+
+        total = sp.local("total", sp.mutez(0))
+        with sp.for_("transactionId", transactionIds) as transactionId:
+            self.verifyExists(transactionId)
+            transaction = self.loadTransaction(transactionId)
+            self.creditCounterparty(transactionId, transaction)
+            total.value += transaction.fee
+            self.saveTransaction(transactionId, transaction)
+
+        sp.verify(sp.amount == total.value,
+                  self.error("Amount does not match the total fee."))
 
     @sp.entry_point
     def leaveCommission(self, transactionId):
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
 
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
-        sp.verify(self.data.parties[transactionId].counterparty == sp.some(sp.sender),
-                  "Only the counterparty can leave the commission.")
+        transaction = self.loadTransaction(transactionId)
+        self.verifyPending(transaction)
+        self.verifyCounterparty(transactionId, "Only the counterparty can leave the commission.",
+                                transaction)
 
         sp.verify(transaction.balanceCounterparty == sp.tez(0),
-                  "Funds are deposited. Request for cancellation instead.")
+                  self.error("Funds are deposited. Request for cancellation instead."))
 
-        self.data.parties[transactionId].counterparty = sp.none
+        self.setParty(transactionId, "counterparty", sp.none, transaction)
+        self.saveParties(transactionId, transaction)
 
     ### OWNER AND COUNTERPARTY INTERFACES ###
-    @sp.entry_point
+    @sp.entry_point(lazify=False)
     def approveCommission(self, transactionId):
-        owner = self.data.parties[transactionId].owner.open_some(
-        )
-        sp.set_type(transactionId, sp.TString)
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
 
-        transaction = self.data.transactions[transactionId]
-        sp.verify(transaction.status == sp.int(0),
-                  "Transaction is not pending.")
+        transaction = self.loadTransaction(transactionId)
+        owner = self.partiesOf(transactionId, transaction).owner.open_some()
+        self.verifyPending(transaction)
 
         sp.verify(transaction.balanceOwner == transaction.offer,
-                  "Owner did not deposit funds.")
+                  self.error("Owner did not deposit funds."))
         sp.verify(transaction.balanceCounterparty == transaction.fee,
-                  "Counterparty did not deposit funds.")
+                  self.error("Counterparty did not deposit funds."))
         sp.verify(sp.sender == owner,
-                  "Only the owner can approve the commission.")
+                  self.error("Only the owner can approve the commission."))
 
-        transaction.epoch = sp.now.add_seconds(sp.to_int(transaction.duration))
-        transaction.status = sp.int(1)
+        self.activate(transactionId, transaction)
+        self.saveTransaction(transactionId, transaction)
 
-    def claim(self, identity, transactionId):
-        sp.set_type(identity, sp.TAddress)
-        sp.set_type(transactionId, sp.TString)
+    def payout(self, recipient, amount):
+        if self.pullPayments:
+            self.data.credits[recipient] = self.data.credits.get(
+                recipient, sp.mutez(0)) + amount
+        else:
+            sp.send(recipient, amount)
+
+    def addWithdraw(self):
+        def withdraw(self):
+            amount = sp.local("amount", self.data.credits.get(
+                sp.sender, sp.mutez(0)))
+            sp.verify(amount.value != sp.mutez(0), self.error("Nothing to withdraw."))
 
-        transaction = self.data.transactions[transactionId]
+            del self.data.credits[sp.sender]
+            sp.send(sp.sender, amount.value)
+
+        self.withdraw = sp.entry_point(lazify=False)(withdraw)
+
+    def claim(self, identity, transaction):
+        sp.set_type(identity, sp.TAddress)
 
-        sp.verify(transaction.status == sp.int(1),
-                  "Transaction is not active.")
+        sp.verify(self.isStatus(transaction, 1),
+                  self.error("Transaction is not active."))
         sp.verify((transaction.balanceOwner == transaction.offer) & (transaction.balanceCounterparty == transaction.fee),
-                  "Both parties must deposit!")
+                  self.error("Both parties must deposit!"))
 
         sp.verify(sp.sender == identity,
-                  "Only the owner or counterparty can claim!")
+                  self.error("Only the owner or counterparty can claim!"))
 
-        sp.send(identity, transaction.balanceOwner +
-                transaction.balanceCounterparty)
+        self.settle(identity, transaction)
+
+    def settle(self, recipient, transaction):
+        self.payout(recipient, transaction.balanceOwner +
+                    transaction.balanceCounterparty)
+        self.countLocked(transaction.balanceOwner +
+                         transaction.balanceCounterparty, -1)
         transaction.balanceOwner = sp.tez(0)
         transaction.balanceCounterparty = sp.tez(0)
-        transaction.status = sp.int(2)
+        self.setStatus(transaction, 2, previous=[1])
 
-    @sp.entry_point
+    @sp.entry_point(lazify=False)
     def claimCounterparty(self, transactionId, secret):
-        counterparty = self.data.parties[transactionId].counterparty.open_some(
-        )
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        counterparty = sp.local("counterparty", self.partiesOf(
+            transactionId, transaction).counterparty.open_some()).value
         sp.verify(sp.sender == counterparty,
-                  "Only the counterparty can claim!")
+                  self.error("Only the counterparty can claim!"))
 
-        transaction = self.data.transactions[transactionId]
-
-        sp.verify(~transaction.counterpartyHasWithdrawn,
-                  "Counterparty pending withdrawal from commission!")
+        sp.verify(~self.hasWithdrawn(transaction, "counterparty"),
+                  self.error("Counterparty pending withdrawal from commission!"))
 
         sp.verify(transaction.epoch > sp.now,
-                  "Commission duration expired!")
+                  self.error("Commission duration expired!"))
         sp.set_type(secret.open_some(), sp.TString)
-        sp.verify(transaction.hashedSecret.open_some()
-                  == sp.blake2b(sp.pack(secret.open_some())), "Secret does not match!")
+        sp.verify(self.detailsOf(transactionId, transaction).hashedSecret.open_some()
+                  == sp.blake2b(sp.pack(secret.open_some())), self.error("Secret does not match!"))
 
-        self.claim(counterparty, transactionId)
+        self.claim(counterparty, transaction)
+        self.saveTransaction(transactionId, transaction)
 
-    @sp.entry_point
+    @sp.entry_point(lazify=False)
     def claimOwner(self, transactionId):
-        owner = self.data.parties[transactionId].owner.open_some(
-        )
-        sp.verify(self.data.transactions.contains(transactionId),
-                  "Transaction does not exist.")
-        sp.verify(sp.sender == owner, "Only the owner can claim!")
-
-        transaction = self.data.transactions[transactionId]
-
-        sp.verify(~transaction.ownerHasWithdrawn,
-                  "Owner pending withdrawal from commission!")
+        sp.set_type(transactionId, self.keyType)
+        self.verifyExists(transactionId)
+        transaction = self.loadTransaction(transactionId)
+        owner = sp.local("owner", self.partiesOf(
+            transactionId, transaction).owner.open_some()).value
+        sp.verify(sp.sender == owner, self.error("Only the owner can claim!"))
+
+        sp.verify(~self.hasWithdrawn(transaction, "owner"),
+                  self.error("Owner pending withdrawal from commission!"))
         sp.verify(transaction.epoch < sp.now,
-                  "Commission duration not finished!")
-
-        self.claim(owner, transactionId)
-
-
-@ sp.add_test(name="Escrow")
-def test():
+                  self.error("Commission duration not finished!"))
+
+        self.claim(owner, transaction)
+        self.saveTransaction(transactionId, transaction)
+
+    def addSweepExpired(self):
+        def sweepExpired(self, limit):
+            # Settles up to `limit` queued commissions whose deadline has
+            # passed to their owners, as claimOwner would, crediting them.
+            # Entries of commissions that were claimed, reverted or
+            # rescheduled since, or that claimOwner would reject, are dropped.
+            sp.set_type(limit, sp.TNat)
+
+            cursor = self.data.expiryCursor
+            steps = sp.local("steps", sp.nat(0))
+            done = sp.local("done", cursor.pending == 0)
+            with sp.while_(~done.value & (steps.value < limit)):
+                steps.value += 1
+                key = sp.pair(cursor.bucket, cursor.index)
+                with sp.if_(self.data.expiries.contains(key)):
+                    entry = sp.local("entry", self.data.expiries[key])
+                    due = sp.local("due", True)
+                    transactionId = entry.value.transactionId
+                    with sp.if_(self.hasTransaction(transactionId)):
+                        transaction = self.loadTransaction(transactionId)
+                        with sp.if_(self.isStatus(transaction, 1) &
+                                    (transaction.epoch == entry.value.epoch)):
+                            with sp.if_(transaction.epoch < sp.now):
+                                with sp.if_(self.isSettleable(transactionId, transaction)):
+                                    self.settle(
+                                        self.partiesOf(transactionId, transaction).owner.open_some(),
+                                        transaction)
+                                    self.saveTransaction(transactionId, transaction)
+                            with sp.else_():
+                                due.value = False
+
+                    with sp.if_(due.value):
+                        del self.data.expiries[key]
+                        cursor.index += 1
+                        cursor.pending = sp.as_nat(cursor.pending - 1)
+                        done.value = cursor.pending == 0
+                    with sp.else_():
+                        done.value = True
+                with sp.else_():
+                    # The bucket is exhausted. No entry can be added to it
+                    # once its whole window is in the past.
+                    with sp.if_(self.expiryBucket(sp.now) > cursor.bucket):
+                        del self.data.expiryCounts[cursor.bucket]
+                        cursor.bucket += 1
+                        cursor.index = 0
+                    with sp.else_():
+                        done.value = True
+
+        self.sweepExpired = sp.entry_point(sweepExpired)
+
+    ### VIEWS ###
+
+    @sp.onchain_view()
+    def getCommission(self, transactionId):
+        """The stored commission record."""
+        sp.set_type(transactionId, self.keyType)
+        sp.verify(self.hasTransaction(transactionId),
+                  self.error("Transaction does not exist."))
+        sp.result(self.transactionOf(transactionId))
+
+    @sp.onchain_view()
+    def getParties(self, transactionId):
+        """The owner and counterparty of a commission."""
+        sp.set_type(transactionId, self.keyType)
+        sp.verify(self.hasTransaction(transactionId),
+                  self.error("Transaction does not exist."))
+        parties = self.partiesOf(transactionId)
+        sp.result(sp.record(owner=parties.owner,
+                            counterparty=parties.counterparty))
+
+    def canClaim(self, transactionId, address):
+        claimable = sp.local("claimable", False)
+        with sp.if_(self.hasTransaction(transactionId)):
+            transaction = self.loadTransaction(transactionId)
+            parties = self.partiesOf(transactionId, transaction)
+            funded = (self.isStatus(transaction, 1) &
+                      (transaction.balanceOwner == transaction.offer) &
+                      (transaction.balanceCounterparty == transaction.fee))
+            asOwner = ((parties.owner == sp.some(address)) &
+                       ~self.hasWithdrawn(transaction, "owner") &
+                       (transaction.epoch < sp.now))
+            asCounterparty = ((parties.counterparty == sp.some(address)) &
+                              ~self.hasWithdrawn(transaction, "counterparty") &
+                              (transaction.epoch > sp.now))
+            claimable.value = funded & (asOwner | asCounterparty)
+        return claimable.value
+
+    @sp.onchain_view()
+    def isClaimable(self, params):
+        """Whether `address` could claim the commission now. The
+        counterparty's secret is not checked."""
+        sp.set_type(params, sp.TRecord(
+            transactionId=self.keyType, address=sp.TAddress))
+        sp.result(self.canClaim(params.transactionId, params.address))
+
+    def addUserIndexView(self):
+        def userCommissions(self, address):
+            """The IDs `address` owns and is the counterparty of."""
+            sp.set_type(address, sp.TAddress)
+            sp.result(self.data.userCommissions.get(
+                address,
+                default_value=sp.record(
+                    owner=sp.set([], t=self.keyType),
+                    counterparty=sp.set([], t=self.keyType),
+                ),
+            ))
+
+        self.userCommissions = sp.onchain_view()(userCommissions)
+
+    def addLegacyIdView(self):
+        def commissionId(self, legacyId):
+            """The counter key of the commission posted or migrated under
+            the string ID `legacyId`, if resetEscrow has not cleared it."""
+            sp.set_type(legacyId, sp.TString)
+            sp.result(self.data.legacyIds.get_opt(legacyId))
+
+        self.commissionId = sp.onchain_view()(commissionId)
+
+    def addOffchainViews(self):
+        def status(self, transactionId):
+            """Status of a commission: 0 pending, 1 active, 2 completed,
+            -1 cancelled."""
+            sp.set_type(transactionId, self.keyType)
+            sp.verify(self.hasTransaction(transactionId),
+                      self.error("Transaction does not exist."))
+            sp.result(self.statusOf(self.transactionOf(transactionId)))
+
+        def claimable(self, params):
+            """Whether `address` could claim the commission now. The
+            counterparty's secret is not checked."""
+            sp.set_type(params, sp.TRecord(
+                transactionId=self.keyType, address=sp.TAddress))
+            sp.result(self.canClaim(params.transactionId, params.address))
+
+        def deadline(self, transactionId):
+            """When an active commission expires: the counterparty can
+            claim before it, the owner after it."""
+            sp.set_type(transactionId, self.keyType)
+            sp.verify(self.hasTransaction(transactionId),
+                      self.error("Transaction does not exist."))
+            transaction = self.transactionOf(transactionId)
+            sp.result(sp.eif(self.isStatus(transaction, 1),
+                             sp.some(transaction.epoch),
+                             sp.none))
+
+        self.status = sp.offchain_view(pure=True)(status)
+        self.claimable = sp.offchain_view()(claimable)
+        self.deadline = sp.offchain_view(pure=True)(deadline)
+
+        self.init_metadata("metadata", dict(
+            name="Escrow",
+            description="Commissions with deposits held in escrow.",
+            interfaces=["TZIP-016"],
+            views=[self.status, self.claimable, self.deadline],
+        ))
+
+def escrowScenario(title, **options):
     scenario = sp.test_scenario()
-    scenario.h1("Escrow")
+    scenario.h1(title)
 
     admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
     owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
@@ -597,8 +1779,54 @@ def test():
 
     c1 = Escrow(
         admin,
+        **options
     )
 
+    # With counterIds the commissions below are keyed by the nat assigned
+    # from nextId, which resetEscrow rewinds, and their names are aliases.
+    counterKeys = dict(first=0, second=0, third=1, fourth=2, fifth=4, sixth=5,
+                       missing=1000)
+
+    def key(name):
+        if c1.counterIds:
+            return sp.nat(counterKeys[name])
+        return name
+
+    def alias(name):
+        if c1.counterIds:
+            return sp.some(name)
+        return name
+
+    def partiesOf(name):
+        if c1.merged:
+            return c1.data.commissions[key(name)]
+        return c1.data.parties[key(name)]
+
+    def transactionOf(name):
+        if c1.merged:
+            return c1.data.commissions[key(name)]
+        return c1.data.transactions[key(name)]
+
+    def detailsOf(name):
+        if c1.splitDetails:
+            return c1.data.details[key(name)]
+        return transactionOf(name)
+
+    def isStatus(name, status):
+        if c1.packedStatus:
+            return (transactionOf(name).state & 3) == STATUS_BITS[status]
+        return transactionOf(name).status == status
+
+    def verifyStats(pending, active, completed, cancelled, pendingReverts, totalLocked):
+        if not c1.stats:
+            return
+        scenario.verify(c1.data.stats.pending == pending)
+        scenario.verify(c1.data.stats.active == active)
+        scenario.verify(c1.data.stats.completed == completed)
+        scenario.verify(c1.data.stats.cancelled == cancelled)
+        scenario.verify(c1.data.stats.pendingReverts == pendingReverts)
+        scenario.verify(c1.data.stats.totalLocked == totalLocked)
+
     scenario += c1
 
     ### create_transaction ###
@@ -608,7 +1836,7 @@ def test():
         title="Cat caretaker",
         owner=owner,
         counterparty=counterparty,
-        transactionId="first",
+        transactionId=key("first"),
         offer=sp.tez(100),
         fee=sp.tez(1),
         duration=100,
@@ -617,7 +1845,7 @@ def test():
     ).run(sender=admin)
 
     scenario += c1.setCommissionStatus(
-        transactionId="first",
+        transactionId=key("first"),
         status=sp.int(0)
     ).run(sender=admin)
 
@@ -625,47 +1853,76 @@ def test():
     scenario += c1.setCommissionParticipants(
         owner=owner,
         counterparty=counterparty,
-        transactionId="first"
+        transactionId=key("first")
     ).run(sender=admin, valid=False)
 
     scenario.h2("Deposit owner")
     scenario += c1.depositOwner(
-        "first"
+        key("first")
     ).run(sender=owner, amount=sp.tez(50), valid=False)
     scenario += c1.depositOwner(
-        "first"
+        key("first")
     ).run(sender=owner, amount=sp.tez(100), valid=True)
     scenario += c1.depositOwner(
-        "first"
+        key("first")
     ).run(sender=owner, amount=sp.tez(100), valid=False)
 
     scenario.h2("Deposit counterparty")
     scenario += c1.depositCounterparty(
-        "first"
+        key("first")
     ).run(sender=counterparty, amount=sp.tez(2), valid=False)
     scenario += c1.depositCounterparty(
-        "first"
+        key("first")
     ).run(sender=counterparty, amount=sp.tez(1), valid=True)
     scenario += c1.depositCounterparty(
-        "first"
+        key("first")
     ).run(sender=counterparty, amount=sp.tez(1), valid=False)
 
     scenario.h2("Activate transaction")
     scenario += c1.activateCommission(
-        "first"
+        key("first")
     ).run(sender=owner, valid=True)
 
     scenario.h2("Claim owner")
     scenario += c1.claimOwner(
-        "first"
+        key("first")
     ).run(sender=owner, now=sp.timestamp(125))
     scenario += c1.claimCounterparty(
-        transactionId="first",
+        transactionId=key("first"),
         secret=sp.some("secret_key!")
     ).run(sender=counterparty, valid=False)
 
+    scenario.h2("Batched admin update")
+    updates = [
+        sp.record(
+            transactionId=key("first"),
+            updates=[
+                sp.variant("duration", sp.nat(50)),
+                sp.variant("epoch", sp.timestamp(10)),
+                sp.variant("status", sp.int(-1)),
+            ],
+        ),
+    ]
+    scenario += c1.updateTransactions(updates).run(sender=owner, valid=False)
+    scenario += c1.updateTransactions(updates).run(sender=admin, valid=True)
+    scenario.verify(transactionOf("first").duration == 50)
+    scenario.verify(transactionOf("first").epoch == sp.timestamp(10))
+    scenario.verify(isStatus("first", -1))
+    scenario += c1.updateTransactions([
+        sp.record(
+            transactionId=key("missing"),
+            updates=[sp.variant("duration", sp.nat(50))],
+        ),
+    ]).run(sender=admin, valid=False)
+
+    verifyStats(0, 0, 0, 1, 0, sp.tez(0))
+
     scenario.h2("Reset escrow")
     scenario += c1.resetEscrow().run(sender=admin)
+    verifyStats(0, 0, 0, 0, 0, sp.tez(0))
+    if c1.counterIds:
+        scenario.verify(c1.data.nextId == 0)
+        scenario.verify(c1.commissionId("first") == sp.none)
 
     ### owner posts commission ###
 
@@ -682,32 +1939,43 @@ def test():
 
     scenario.h2("Accept commission")
     scenario += c1.acceptCommission(
-        "second"
+        key("second")
     ).run(sender=counterparty, valid=True)
 
     scenario.h2("Deposit owner")
     scenario += c1.depositOwner(
-        "second"
+        key("second")
     ).run(sender=owner, amount=sp.tez(100), valid=True)
 
     scenario.h2("Deposit counterparty")
     scenario += c1.depositCounterparty(
-        "second"
+        key("second")
     ).run(sender=counterparty, amount=sp.tez(1), valid=True)
 
     scenario.h2("Activate transaction")
     scenario += c1.activateCommission(
-        "second"
+        key("second")
     ).run(sender=owner, valid=True)
 
+    scenario.h2("Views")
+    scenario.verify(c1.getParties(key("second")).counterparty == sp.some(counterparty))
+    scenario.verify(c1.getCommission(key("second")).offer == sp.tez(100))
+    scenario.verify(~c1.isClaimable(
+        sp.record(transactionId=key("second"), address=admin)))
+    scenario.verify(~c1.isClaimable(
+        sp.record(transactionId=key("missing"), address=owner)))
+    if c1.counterIds:
+        scenario.verify(c1.commissionId("second") == sp.some(key("second")))
+
     scenario.h2("Claim counterparty")
     scenario += c1.claimCounterparty(
-        transactionId="second",
+        transactionId=key("second"),
         secret=sp.some("rat_killers_are_cool!")
     ).run(sender=counterparty, now=sp.timestamp(20), valid=True)
+    scenario.verify(isStatus("second", 2))
     scenario.h2("Claim owner")
     scenario += c1.claimOwner(
-        "second"
+        key("second")
     ).run(sender=owner, now=sp.timestamp(125), valid=False)
 
     scenario.h2("Withdraw")
@@ -724,43 +1992,45 @@ def test():
 
     scenario.h2("Accept commission")
     scenario += c1.acceptCommission(
-        "third"
+        key("third")
     ).run(sender=counterparty, valid=True)
 
     scenario.h2("Deposit owner")
     scenario += c1.depositOwner(
-        "third"
+        key("third")
     ).run(sender=owner, amount=sp.tez(100), valid=True)
 
     scenario.h2("Deposit counterparty")
     scenario += c1.depositCounterparty(
-        "third"
+        key("third")
     ).run(sender=counterparty, amount=sp.tez(1), valid=True)
 
     scenario.h2("Activate transaction")
     scenario += c1.activateCommission(
-        "third"
+        key("third")
     ).run(sender=owner, valid=True)
 
     scenario.h2("Cancel commission owner")
     scenario += c1.cancelCommissionOwner(
-        "third"
+        key("third")
     ).run(sender=owner, valid=True)
 
     scenario.h2("Try revert funds")
     scenario += c1.revertCommissionFunds(
-        "third"
+        key("third")
     ).run(sender=admin, valid=False)
 
     scenario.h2("Cancel commission counterparty")
     scenario += c1.cancelCommissionCounterparty(
-        "third"
+        key("third")
     ).run(sender=counterparty, valid=True)
+    verifyStats(0, 1, 1, 0, 1, sp.tez(101))
 
     scenario.h2("Revert funds")
     scenario += c1.revertCommissionFunds(
-        "third"
+        key("third")
     ).run(sender=admin, valid=True)
+    scenario.verify(isStatus("third", -1))
 
     scenario.h2("Counterparty leaves before the transaction is active")
     scenario += c1.postCommission(
@@ -775,42 +2045,42 @@ def test():
 
     scenario.h2("Accept commission")
     scenario += c1.acceptCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=counterparty, valid=True)
 
     scenario.h2("Leave commission")
     scenario += c1.leaveCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=counterparty, valid=True)
 
     scenario.h2("Try revert funds")
     scenario += c1.revertCommissionFunds(
-        "fourth"
+        key("fourth")
     ).run(sender=admin, valid=False)
 
     scenario.h2("Owner tries to activate transaction")
     scenario += c1.activateCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=owner, valid=False)
 
     scenario.h2("Counterparty joins again")
     scenario += c1.acceptCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=counterparty, valid=True)
 
     scenario.h2("Activate transaction")
     scenario += c1.activateCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=owner, valid=False)
 
     scenario.h2("Owner deposits")
     scenario += c1.depositCounterparty(
-        "fourth"
+        key("fourth")
     ).run(sender=counterparty, amount=sp.tez(1), valid=True)
 
     scenario.h2("Counterparty tries to leave")
     scenario += c1.leaveCommission(
-        "fourth"
+        key("fourth")
     ).run(sender=counterparty, valid=False)
     scenario += c1.postCommission(
         transactionId=sp.none,
@@ -822,8 +2092,878 @@ def test():
         secret="rat_killers_are_cool!"
     ).run(sender=counterparty, valid=True)
 
+    scenario.h2("Post commissions in one batch")
+    scenario += c1.postCommissions([
+        sp.record(
+            transactionId=alias("fifth"),
+            offer=sp.tez(10),
+            fee=sp.tez(1),
+            duration=100,
+            title="Dog walker",
+            description="Walk my dog every morning.",
+            hashedSecret=sp.blake2b(sp.pack("woof"))
+        ),
+        sp.record(
+            transactionId=alias("sixth"),
+            offer=sp.tez(20),
+            fee=sp.tez(2),
+            duration=200,
+            title="Plant sitter",
+            description="Water my plants while I am away.",
+            hashedSecret=sp.blake2b(sp.pack("leaf"))
+        ),
+    ]).run(sender=owner, valid=True)
+    scenario.verify(partiesOf("sixth").owner == sp.some(owner))
+    scenario.verify(transactionOf("sixth").duration == 200)
+    scenario.verify(detailsOf("sixth").hashedSecret ==
+                    sp.some(sp.blake2b(sp.pack("leaf"))))
+
+    scenario.h2("Batch with an existing transaction fails")
+    scenario += c1.postCommissions([
+        sp.record(
+            transactionId=alias("seventh"),
+            offer=sp.tez(10),
+            fee=sp.tez(1),
+            duration=100,
+            title="Dog walker",
+            description="Walk my dog every evening.",
+            hashedSecret=sp.blake2b(sp.pack("woof"))
+        ),
+        sp.record(
+            transactionId=alias("fifth"),
+            offer=sp.tez(10),
+            fee=sp.tez(1),
+            duration=100,
+            title="Dog walker",
+            description="Walk my dog every morning.",
+            hashedSecret=sp.blake2b(sp.pack("woof"))
+        ),
+    ]).run(sender=owner, valid=False)
+
+    scenario.h2("Accept batch commissions")
+    scenario += c1.acceptCommission(
+        key("fifth")
+    ).run(sender=counterparty, valid=True)
+    scenario += c1.acceptCommission(
+        key("sixth")
+    ).run(sender=counterparty, valid=True)
 
-sp.add_compilation_target(
-    "escrow",
-    Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"))
-)
+    scenario.h2("Deposit owner batch")
+    scenario += c1.depositOwnerBatch(
+        [key("fifth"), key("sixth")]
+    ).run(sender=owner, amount=sp.tez(20), valid=False)
+    scenario += c1.depositOwnerBatch(
+        [key("fifth"), key("fifth")]
+    ).run(sender=owner, amount=sp.tez(20), valid=False)
+    scenario += c1.depositOwnerBatch(
+        [key("fifth"), key("sixth")]
+    ).run(sender=owner, amount=sp.tez(30), valid=True)
+    scenario.verify(transactionOf("sixth").balanceOwner == sp.tez(20))
+
+    scenario.h2("Deposit counterparty batch")
+    scenario += c1.depositCounterpartyBatch(
+        [key("fifth"), key("sixth")]
+    ).run(sender=owner, amount=sp.tez(3), valid=False)
+    scenario += c1.depositCounterpartyBatch(
+        [key("fifth"), key("sixth")]
+    ).run(sender=counterparty, amount=sp.tez(3), valid=True)
+    scenario.verify(transactionOf("fifth").balanceCounterparty == sp.tez(1))
+    verifyStats(4, 0, 1, 1, 0, sp.tez(34))
+
+
+# Scripts importing this file under a templates name, as SmartPy imports its
+# templates (see stress_scenario.py), get the contract without registering its
+# scenarios and compilation targets.
+if "templates" not in __name__:
+    @sp.add_test(name="Escrow")
+    def test():
+        escrowScenario("Escrow")
+
+
+    @sp.add_test(name="EscrowMerged")
+    def testMerged():
+        escrowScenario("Escrow (merged layout)", merged=True)
+
+
+    @sp.add_test(name="EscrowPackedStatus")
+    def testPackedStatus():
+        escrowScenario("Escrow (packed status)", packedStatus=True)
+
+
+    @sp.add_test(name="EscrowLazy")
+    def testLazy():
+        escrowScenario("Escrow (lazy entrypoints)", lazyEntrypoints=True)
+
+
+    @sp.add_test(name="EscrowSplitDetails")
+    def testSplitDetails():
+        escrowScenario("Escrow (hot/cold split)", splitDetails=True)
+
+
+    @sp.add_test(name="EscrowCounterIds")
+    def testCounterIds():
+        escrowScenario("Escrow (counter keys)", counterIds=True)
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (counter keys)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        c1 = Escrow(admin, counterIds=True)
+        scenario += c1
+
+        scenario.h2("Posts without an ID get distinct keys")
+        for _ in range(2):
+            scenario += c1.postCommission(
+                transactionId=sp.none,
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="[URGENT] Rat killer ninja needed!",
+                description="I need a rat killer ninja to kill my rats.",
+                secret="rat_killers_are_cool!"
+            ).run(sender=owner, valid=True)
+        scenario.verify(c1.data.nextId == 2)
+        scenario.verify(c1.data.transactions.contains(0))
+        scenario.verify(c1.data.transactions.contains(1))
+
+        scenario.h2("String IDs are kept as aliases")
+        scenario += c1.postCommission(
+            transactionId=sp.some("second"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            title="[URGENT] Rat killer ninja needed!",
+            description="I need a rat killer ninja to kill my rats.",
+            secret="rat_killers_are_cool!"
+        ).run(sender=owner, valid=True)
+        scenario.verify(c1.data.legacyIds["second"] == 2)
+        scenario += c1.postCommission(
+            transactionId=sp.some("second"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            title="[URGENT] Rat killer ninja needed!",
+            description="I need a rat killer ninja to kill my rats.",
+            secret="rat_killers_are_cool!"
+        ).run(sender=owner, valid=False)
+
+        scenario.h2("Deposit by counter key")
+        scenario += c1.acceptCommission(2).run(sender=counterparty, valid=True)
+        scenario += c1.depositOwner(2).run(
+            sender=owner, amount=sp.tez(100), valid=True)
+
+        scenario.h2("Migrate a funded commission")
+        migrated = sp.record(
+            offer=sp.tez(10),
+            fee=sp.tez(1),
+            balanceOwner=sp.tez(10),
+            balanceCounterparty=sp.tez(1),
+            epoch=sp.timestamp(0),
+            duration=sp.nat(100),
+            hashedSecret=sp.some(sp.blake2b(sp.pack("ratatouille"))),
+            ownerHasWithdrawn=False,
+            counterpartyHasWithdrawn=False,
+            description="I need a rat killer ninja to kill my rats.",
+            title="[URGENT] Rat killer ninja needed!",
+            status=sp.int(0),
+        )
+        scenario += c1.migrateCommission(
+            legacyId="third",
+            owner=sp.some(owner),
+            counterparty=sp.some(counterparty),
+            transaction=migrated,
+        ).run(sender=owner, amount=sp.tez(11), valid=False)
+        scenario += c1.migrateCommission(
+            legacyId="third",
+            owner=sp.some(owner),
+            counterparty=sp.some(counterparty),
+            transaction=migrated,
+        ).run(sender=admin, amount=sp.tez(10), valid=False)
+        scenario += c1.migrateCommission(
+            legacyId="third",
+            owner=sp.some(owner),
+            counterparty=sp.some(counterparty),
+            transaction=migrated,
+        ).run(sender=admin, amount=sp.tez(11), valid=True)
+        scenario.verify(c1.data.legacyIds["third"] == 3)
+        scenario += c1.approveCommission(3).run(sender=owner, valid=True)
+
+
+    @sp.add_test(name="EscrowPullPayments")
+    def testPullPayments():
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (pull payments)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        c1 = Escrow(admin, pullPayments=True)
+        scenario += c1
+
+        for transactionId in ["first", "second"]:
+            scenario.h2("Fund %s commission" % transactionId)
+            scenario += c1.postCommission(
+                transactionId=sp.some(transactionId),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="[URGENT] Rat killer ninja needed!",
+                description="I need a rat killer ninja to kill my rats.",
+                secret="rat_killers_are_cool!"
+            ).run(sender=owner, valid=True)
+            scenario += c1.acceptCommission(
+                transactionId
+            ).run(sender=counterparty, valid=True)
+            scenario += c1.depositOwner(
+                transactionId
+            ).run(sender=owner, amount=sp.tez(100), valid=True)
+            scenario += c1.depositCounterparty(
+                transactionId
+            ).run(sender=counterparty, amount=sp.tez(1), valid=True)
+            scenario += c1.approveCommission(
+                transactionId
+            ).run(sender=owner, now=sp.timestamp(0), valid=True)
+
+        scenario.h2("Claims are credited, not sent")
+        for transactionId in ["first", "second"]:
+            scenario += c1.claimCounterparty(
+                transactionId=transactionId,
+                secret=sp.some("rat_killers_are_cool!")
+            ).run(sender=counterparty, now=sp.timestamp(20), valid=True)
+        scenario.verify(c1.data.credits[counterparty] == sp.tez(202))
+        scenario.verify(c1.balance == sp.tez(202))
+
+        scenario.h2("Withdraw")
+        scenario += c1.withdraw().run(sender=owner, valid=False)
+        scenario += c1.withdraw().run(sender=counterparty, valid=True)
+        scenario.verify(~c1.data.credits.contains(counterparty))
+        scenario.verify(c1.balance == sp.tez(0))
+        scenario += c1.withdraw().run(sender=counterparty, valid=False)
+
+
+    @sp.add_test(name="EscrowOffchainMetadata")
+    def testOffchainMetadata():
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (off-chain metadata)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+
+        c1 = Escrow(admin, offchainMetadata=True)
+        scenario += c1
+
+        # What metadata_store.py returns for the title and description below.
+        digest = "71bd57a4d1320a989853048e529036244856b2953a90cfeae71afea33cbfa03a"
+        metadataHash = sp.bytes("0x" + digest)
+        metadataUri = "local://" + digest
+
+        scenario.h2("Details must go off-chain")
+        scenario += c1.postCommission(
+            transactionId=sp.some("first"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            title="Cat caretaker",
+            description="Need someone to take care of my cat in 100 seconds!",
+            secret="secret_key!"
+        ).run(sender=owner, valid=False)
+
+        scenario.h2("Post with a content hash")
+        scenario += c1.postCommissionMetadata(
+            transactionId=sp.some("first"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            metadataHash=sp.bytes("0x3f3f"),
+            metadataUri=metadataUri,
+            secret="secret_key!"
+        ).run(sender=owner, valid=False)
+        scenario += c1.postCommissionMetadata(
+            transactionId=sp.some("first"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            metadataHash=metadataHash,
+            metadataUri=metadataUri,
+            secret="secret_key!"
+        ).run(sender=owner, valid=True)
+        scenario.verify(c1.data.transactions["first"].metadataHash == metadataHash)
+
+        scenario.h2("Admin details must go off-chain")
+        scenario += c1.setCommissionDetails(
+            title="Cat caretaker",
+            owner=owner,
+            counterparty=admin,
+            transactionId="first",
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            description="Need someone to take care of my cat in 100 seconds!",
+            secret="secret_key!"
+        ).run(sender=admin, valid=False,
+              exception="Commission details are stored off-chain.")
+        scenario.verify(c1.data.transactions["first"].status == 0)
+        scenario.verify(c1.data.parties["first"].counterparty == sp.none)
+
+        scenario.h2("Edit metadata")
+        scenario += c1.editCommissionMetadata(
+            transactionId="first",
+            metadataHash=sp.bytes("0x" + "42" * 32),
+            metadataUri="local://" + "42" * 32,
+        ).run(sender=owner, valid=True)
+        scenario.verify(c1.data.transactions["first"].metadataUri == "local://" + "42" * 32)
+
+
+    @sp.add_test(name="EscrowUserIndex")
+    def testUserIndex():
+        escrowScenario("Escrow (user index)", userIndex=True)
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (user index bookkeeping)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        c1 = Escrow(admin, userIndex=True)
+        scenario += c1
+
+        scenario.h2("Posting indexes the owner")
+        for transactionId in ["first", "second"]:
+            scenario += c1.postCommission(
+                transactionId=sp.some(transactionId),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat in 100 seconds!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+        scenario.verify(sp.len(c1.data.userCommissions[owner].owner) == 2)
+        scenario.verify(sp.len(c1.userCommissions(owner).owner) == 2)
+        scenario.verify(sp.len(c1.userCommissions(counterparty).counterparty) == 0)
+
+        scenario.h2("Accepting and leaving index the counterparty")
+        scenario += c1.acceptCommission("first").run(
+            sender=counterparty, valid=True)
+        scenario.verify(
+            c1.data.userCommissions[counterparty].counterparty.contains("first"))
+        scenario += c1.leaveCommission("first").run(
+            sender=counterparty, valid=True)
+        scenario.verify(~c1.data.userCommissions.contains(counterparty))
+
+        scenario.h2("Deleting unindexes the commission")
+        for transactionId in ["first", "second"]:
+            scenario += c1.setCommissionStatus(
+                transactionId=transactionId, status=-1).run(sender=admin, valid=True)
+        scenario += c1.deleteCommission("second").run(sender=owner, valid=True)
+        scenario.verify(
+            ~c1.data.userCommissions[owner].owner.contains("second"))
+        scenario += c1.deleteCommission("first").run(sender=owner, valid=True)
+        scenario.verify(~c1.data.userCommissions.contains(owner))
+
+
+    @sp.add_test(name="EscrowOffchainViews")
+    def testOffchainViews():
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        for packedStatus in [False, True]:
+            scenario = sp.test_scenario()
+            scenario.h1("Escrow (off-chain views, packedStatus=%s)" % packedStatus)
+
+            c1 = Escrow(admin, packedStatus=packedStatus,
+                        metadataUrl="ipfs://escrow-metadata")
+            scenario += c1
+
+            scenario += c1.postCommission(
+                transactionId=sp.some("first"),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat in 100 seconds!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+
+            scenario.h2("Pending")
+            scenario.verify(c1.status("first") == 0)
+            scenario.verify(c1.deadline("first") == sp.none)
+            scenario.verify(~c1.claimable(
+                sp.record(transactionId="first", address=owner)))
+
+            scenario.h2("Active")
+            scenario += c1.acceptCommission("first").run(
+                sender=counterparty, valid=True)
+            scenario += c1.depositOwner("first").run(
+                sender=owner, amount=sp.tez(100), valid=True)
+            scenario += c1.depositCounterparty("first").run(
+                sender=counterparty, amount=sp.tez(1), valid=True)
+            scenario += c1.approveCommission("first").run(
+                sender=owner, now=sp.timestamp(0), valid=True)
+            scenario.verify(c1.status("first") == 1)
+            scenario.verify(c1.deadline("first") == sp.some(sp.timestamp(100)))
+            scenario.verify(~c1.claimable(
+                sp.record(transactionId="first", address=admin)))
+
+            scenario.h2("Cancelled")
+            scenario += c1.setCommissionStatus(
+                transactionId="first", status=-1).run(sender=admin, valid=True)
+            scenario.verify(c1.status("first") == -1)
+            scenario.verify(c1.deadline("first") == sp.none)
+
+
+    @sp.add_test(name="EscrowExpiryQueue")
+    def testExpiryQueue():
+        escrowScenario("Escrow (expiry queue)", expiryQueue=True,
+                       pullPayments=True)
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (expiry sweep)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        c1 = Escrow(admin, expiryQueue=True, pullPayments=True)
+        scenario += c1
+
+        durations = dict(first=100, second=200, third=5000)
+        for transactionId, duration in durations.items():
+            scenario.h2("Fund %s commission" % transactionId)
+            scenario += c1.postCommission(
+                transactionId=sp.some(transactionId),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=duration,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+            scenario += c1.acceptCommission(transactionId).run(
+                sender=counterparty, valid=True)
+            scenario += c1.depositOwner(transactionId).run(
+                sender=owner, amount=sp.tez(100), valid=True)
+            scenario += c1.depositCounterparty(transactionId).run(
+                sender=counterparty, amount=sp.tez(1), valid=True)
+            scenario += c1.approveCommission(transactionId).run(
+                sender=owner, now=sp.timestamp(0), valid=True)
+        scenario.verify(c1.data.expiryCursor.pending == 3)
+
+        scenario.h2("Claimed commissions are skipped")
+        scenario += c1.claimCounterparty(
+            transactionId="second",
+            secret=sp.some("secret_key!")
+        ).run(sender=counterparty, now=sp.timestamp(50), valid=True)
+
+        scenario.h2("Nothing has expired yet")
+        scenario += c1.sweepExpired(10).run(now=sp.timestamp(50), valid=True)
+        scenario.verify(c1.data.expiryCursor.pending == 3)
+        scenario.verify(c1.data.transactions["first"].status == 1)
+
+        scenario.h2("Sweep the expired commissions")
+        scenario += c1.sweepExpired(10).run(now=sp.timestamp(300), valid=True)
+        scenario.verify(c1.data.transactions["first"].status == 2)
+        scenario.verify(c1.data.transactions["third"].status == 1)
+        scenario.verify(c1.data.expiryCursor.pending == 1)
+        scenario.verify(c1.data.credits[owner] == sp.tez(101))
+
+        scenario.h2("The limit bounds a sweep")
+        scenario += c1.sweepExpired(1).run(now=sp.timestamp(6000), valid=True)
+        scenario.verify(c1.data.transactions["third"].status == 1)
+        scenario += c1.sweepExpired(10).run(now=sp.timestamp(6000), valid=True)
+        scenario.verify(c1.data.transactions["third"].status == 2)
+        scenario.verify(c1.data.expiryCursor.pending == 0)
+        scenario.verify(c1.data.credits[owner] == sp.tez(202))
+        scenario += c1.withdraw().run(sender=owner, valid=True)
+        scenario.verify(c1.balance == sp.tez(101))
+
+        scenario.h2("Commissions without an owner or deposits are not queued")
+        scenario += c1.createCommission(sp.some("fourth")).run(sender=admin)
+        scenario += c1.setCommissionStatus(
+            transactionId="fourth", status=1).run(sender=admin, valid=True)
+        scenario.verify(c1.data.expiryCursor.pending == 0)
+
+        scenario.h2("Cancelling owners are skipped until they withdraw the cancellation")
+        scenario += c1.postCommission(
+            transactionId=sp.some("fifth"),
+            offer=sp.tez(100),
+            fee=sp.tez(1),
+            duration=100,
+            title="Cat caretaker",
+            description="Need someone to take care of my cat!",
+            secret="secret_key!"
+        ).run(sender=owner, valid=True)
+        scenario += c1.acceptCommission("fifth").run(
+            sender=counterparty, valid=True)
+        scenario += c1.depositOwner("fifth").run(
+            sender=owner, amount=sp.tez(100), valid=True)
+        scenario += c1.depositCounterparty("fifth").run(
+            sender=counterparty, amount=sp.tez(1), valid=True)
+        scenario += c1.approveCommission("fifth").run(
+            sender=owner, now=sp.timestamp(6000), valid=True)
+        scenario += c1.cancelCommissionOwner("fifth").run(
+            sender=owner, now=sp.timestamp(6050), valid=True)
+        scenario += c1.sweepExpired(10).run(now=sp.timestamp(7000), valid=True)
+        scenario.verify(c1.data.transactions["fifth"].status == 1)
+        scenario.verify(c1.data.expiryCursor.pending == 0)
+        scenario += c1.cancelCommissionOwner("fifth").run(
+            sender=owner, now=sp.timestamp(7000), valid=True)
+        scenario.verify(c1.data.expiryCursor.pending == 1)
+        scenario += c1.sweepExpired(10).run(now=sp.timestamp(7000), valid=True)
+        scenario.verify(c1.data.transactions["fifth"].status == 2)
+        scenario.verify(c1.data.expiryCursor.pending == 0)
+        scenario.verify(c1.data.credits[owner] == sp.tez(101))
+        scenario.verify(c1.balance == sp.tez(202))
+
+
+    @sp.add_test(name="EscrowRefunds")
+    def testRefunds():
+        escrowScenario("Escrow (revert queue)", revertQueue=True,
+                       pullPayments=True)
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        def fundAndCancel(scenario, c1, transactionId):
+            scenario.h2("Fund and cancel %s commission" % transactionId)
+            scenario += c1.postCommission(
+                transactionId=sp.some(transactionId),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+            scenario += c1.acceptCommission(transactionId).run(
+                sender=counterparty, valid=True)
+            scenario += c1.depositOwner(transactionId).run(
+                sender=owner, amount=sp.tez(100), valid=True)
+            scenario += c1.depositCounterparty(transactionId).run(
+                sender=counterparty, amount=sp.tez(1), valid=True)
+            scenario += c1.approveCommission(transactionId).run(
+                sender=owner, valid=True)
+            scenario += c1.cancelCommissionOwner(transactionId).run(
+                sender=owner, valid=True)
+            scenario += c1.cancelCommissionCounterparty(transactionId).run(
+                sender=counterparty, valid=True)
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (automatic refund)")
+        c1 = Escrow(admin, autoRefund=True, stats=True)
+        scenario += c1
+        fundAndCancel(scenario, c1, "first")
+        scenario.verify(c1.data.transactions["first"].status == -1)
+        scenario.verify(c1.data.stats.pendingReverts == 0)
+        scenario.verify(c1.balance == sp.tez(0))
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (bulk reverts)")
+        c2 = Escrow(admin, revertQueue=True, pullPayments=True, stats=True)
+        scenario += c2
+        for transactionId in ["first", "second"]:
+            fundAndCancel(scenario, c2, transactionId)
+        scenario.verify(c2.data.revertCursor.tail == 2)
+        scenario.verify(c2.data.stats.pendingReverts == 2)
+
+        scenario.h2("Cancelling again does not queue a commission twice")
+        scenario += c2.cancelCommissionOwner("second").run(
+            sender=owner, valid=True)
+        scenario += c2.cancelCommissionOwner("second").run(
+            sender=owner, valid=True)
+        scenario.verify(c2.data.revertCursor.tail == 2)
+        scenario.verify(c2.data.stats.pendingReverts == 2)
+
+        scenario.h2("Process the queue")
+        scenario += c2.processReverts(1).run(sender=owner, valid=False)
+        scenario += c2.processReverts(1).run(sender=admin, valid=True)
+        scenario.verify(c2.data.transactions["first"].status == -1)
+        scenario.verify(c2.data.transactions["second"].status == 1)
+        scenario += c2.processReverts(10).run(sender=admin, valid=True)
+        scenario.verify(c2.data.transactions["second"].status == -1)
+        scenario.verify(c2.data.revertCursor.head == 2)
+        scenario.verify(c2.data.stats.pendingReverts == 0)
+        scenario.verify(c2.data.credits[owner] == sp.tez(200))
+        scenario.verify(c2.data.credits[counterparty] == sp.tez(2))
+        scenario.verify(c2.balance == sp.tez(202))
+
+
+    @sp.add_test(name="EscrowFastPath")
+    def testFastPath():
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        for autoActivate in [False, True]:
+            scenario = sp.test_scenario()
+            scenario.h1("Escrow (fast path, autoActivate=%s)" % autoActivate)
+
+            c1 = Escrow(admin, autoActivate=autoActivate)
+            scenario += c1
+
+            scenario.h2("Post and deposit")
+            post = dict(
+                transactionId=sp.some("first"),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat!",
+                secret="secret_key!"
+            )
+            scenario += c1.postAndDeposit(**post).run(
+                sender=owner, amount=sp.tez(10), valid=False)
+            scenario += c1.postAndDeposit(**post).run(
+                sender=owner, amount=sp.tez(100), valid=True)
+            scenario.verify(c1.data.transactions["first"].balanceOwner == sp.tez(100))
+
+            scenario.h2("Accept and deposit")
+            scenario += c1.acceptAndDeposit("first").run(
+                sender=counterparty, amount=sp.tez(2), valid=False)
+            scenario += c1.acceptAndDeposit("first").run(
+                sender=counterparty, amount=sp.tez(1), now=sp.timestamp(0), valid=True)
+            scenario.verify(c1.data.parties["first"].counterparty == sp.some(counterparty))
+            scenario.verify(c1.data.transactions["first"].balanceCounterparty == sp.tez(1))
+
+            if autoActivate:
+                scenario.verify(c1.data.transactions["first"].status == 1)
+                scenario.verify(c1.data.transactions["first"].epoch == sp.timestamp(100))
+            else:
+                scenario.verify(c1.data.transactions["first"].status == 0)
+                scenario += c1.approveCommission("first").run(
+                    sender=owner, now=sp.timestamp(0), valid=True)
+
+            scenario.h2("Claim")
+            scenario += c1.claimCounterparty(
+                transactionId="first",
+                secret=sp.some("secret_key!")
+            ).run(sender=counterparty, now=sp.timestamp(20), valid=True)
+            scenario.verify(c1.balance == sp.tez(0))
+
+
+    @sp.add_test(name="EscrowErrorCodes")
+    def testErrorCodes():
+        escrowScenario("Escrow (error codes)", errorCodes=True)
+
+        scenario = sp.test_scenario()
+        scenario.h1("Escrow (error code failures)")
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+
+        c1 = Escrow(admin, errorCodes=True)
+        scenario += c1
+        scenario += c1.resetEscrow().run(
+            sender=owner, valid=False,
+            exception=sp.nat(ERROR_CODES["Only the admin can reset!"]))
+        scenario += c1.depositOwner("missing").run(
+            sender=owner, amount=sp.tez(1), valid=False,
+            exception=sp.nat(ERROR_CODES["Transaction does not exist."]))
+
+
+    @sp.add_test(name="EscrowSharedGuards")
+    def testSharedGuards():
+        escrowScenario("Escrow (shared guards)", sharedGuards=True)
+        escrowScenario("Escrow (shared guards, error codes)",
+                       sharedGuards=True, errorCodes=True)
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        for errorCodes in [False, True]:
+            scenario = sp.test_scenario()
+            scenario.h1("Escrow (shared guard failures, errorCodes=%s)" % errorCodes)
+            c1 = Escrow(admin, sharedGuards=True, errorCodes=errorCodes)
+            scenario += c1
+
+            def exception(message):
+                return sp.nat(ERROR_CODES[message]) if errorCodes else message
+
+            scenario += c1.postCommission(
+                transactionId=sp.some("first"),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+            scenario += c1.acceptCommission("first").run(
+                sender=counterparty, valid=True)
+            scenario += c1.resetEscrow().run(
+                sender=owner, valid=False,
+                exception=exception("Only the admin can reset!"))
+            scenario += c1.revertCommissionFunds("first").run(
+                sender=owner, valid=False,
+                exception=exception("Only the admin can revert the commission funds."))
+            scenario += c1.deleteCommission("first").run(
+                sender=counterparty, valid=False,
+                exception=exception("Only the owner can delete the commission."))
+            scenario += c1.depositOwner("first").run(
+                sender=counterparty, amount=sp.tez(100), valid=False,
+                exception=exception("Only the owner can deposit funds."))
+            scenario += c1.depositCounterparty("first").run(
+                sender=owner, amount=sp.tez(1), valid=False,
+                exception=exception("Only the counterparty can deposit funds."))
+
+
+    @sp.add_test(name="EscrowHotEntrypoints")
+    def testHotEntrypoints():
+        escrowScenario("Escrow (hot entrypoint layout)", hotEntrypoints=True)
+        escrowScenario("Escrow (hot entrypoint layout, pull payments)",
+                       hotEntrypoints=True, pullPayments=True)
+
+
+    @sp.add_test(name="EscrowStats")
+    def testStats():
+        escrowScenario("Escrow (aggregate counters)", stats=True)
+        escrowScenario("Escrow (aggregate counters, merged layout)",
+                       stats=True, merged=True)
+        escrowScenario("Escrow (aggregate counters, packed status)",
+                       stats=True, packedStatus=True)
+
+        admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+        owner = sp.address("tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq")
+        counterparty = sp.address("tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF")
+
+        # A completed commission the owner cancels afterwards is not
+        # pending a revert.
+        for packedStatus in [False, True]:
+            scenario = sp.test_scenario()
+            scenario.h1("Escrow (cancelled after completion, packedStatus=%s)"
+                        % packedStatus)
+            c1 = Escrow(admin, stats=True, packedStatus=packedStatus)
+            scenario += c1
+
+            scenario += c1.postCommission(
+                transactionId=sp.some("first"),
+                offer=sp.tez(100),
+                fee=sp.tez(1),
+                duration=100,
+                title="Cat caretaker",
+                description="Need someone to take care of my cat!",
+                secret="secret_key!"
+            ).run(sender=owner, valid=True)
+            scenario += c1.acceptCommission("first").run(
+                sender=counterparty, valid=True)
+            scenario += c1.depositOwner("first").run(
+                sender=owner, amount=sp.tez(100), valid=True)
+            scenario += c1.depositCounterparty("first").run(
+                sender=counterparty, amount=sp.tez(1), valid=True)
+            scenario += c1.approveCommission("first").run(
+                sender=owner, now=sp.timestamp(0), valid=True)
+            scenario += c1.cancelCommissionCounterparty("first").run(
+                sender=counterparty, valid=True)
+            scenario += c1.claimOwner("first").run(
+                sender=owner, now=sp.timestamp(200), valid=True)
+            scenario += c1.cancelCommissionOwner("first").run(
+                sender=owner, valid=True)
+            scenario.verify(c1.data.stats.pendingReverts == 0)
+            scenario.verify(c1.data.stats.completed == 1)
+            scenario += c1.revertCommissionFunds("first").run(
+                sender=admin, valid=False,
+                exception="Transaction has already been completed.")
+
+
+    sp.add_compilation_target(
+        "escrow",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"))
+    )
+
+    sp.add_compilation_target(
+        "escrow_merged",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), merged=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_counter",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), counterIds=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_pull",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), pullPayments=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_packed",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), packedStatus=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_lazy",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), lazyEntrypoints=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_offchain",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), offchainMetadata=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_split",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), splitDetails=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_indexed",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), userIndex=True)
+    )
+
+    # The metadata JSON compiled with this target holds the off-chain views; the
+    # URL it is published at is passed as metadataUrl when originating.
+    sp.add_compilation_target(
+        "escrow_views",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"),
+               metadataUrl="ipfs://escrow-metadata")
+    )
+
+    sp.add_compilation_target(
+        "escrow_expiry",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"),
+               expiryQueue=True, pullPayments=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_refund",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), autoRefund=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_revert_queue",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"),
+               revertQueue=True, pullPayments=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_auto",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), autoActivate=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_codes",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), errorCodes=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_guards",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), sharedGuards=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_hot",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), hotEntrypoints=True)
+    )
+
+    sp.add_compilation_target(
+        "escrow_stats",
+        Escrow(sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"), stats=True)
+    )
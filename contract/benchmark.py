@@ -0,0 +1,414 @@
+"""Gas and storage benchmark for the Escrow compilation targets.
+
+Every target of contract/Escrow.py is compiled with the SmartPy CLI, originated
+in an octez-client mockup and driven through the same commission lifecycle.
+The gas and paid storage of each call are printed side by side, relative to the
+first target:
+
+    python contract/benchmark.py escrow escrow_merged
+    python contract/benchmark.py escrow escrow_split --description-lengths 32 512 2048
+    python contract/benchmark.py escrow escrow_codes --sizes
+    python contract/benchmark.py escrow escrow_hot --depths
+
+--depths only reads how deeply each entrypoint is nested in the parameter
+type of each target; it does not measure gas. The dispatch gas of escrow_hot
+shows in the lifecycle table, run without --depths.
+
+Both tools run offline. Their locations can be overridden with the SMARTPY_CLI
+and OCTEZ_CLIENT environment variables. Compiled targets are cached by content
+hash in ESCROW_COMPILE_CACHE (~/.cache/escrow/compile by default; set it empty
+to always recompile).
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+SMARTPY_CLI = os.environ.get(
+    "SMARTPY_CLI", os.path.expanduser("~/smartpy-cli/SmartPy.sh"))
+OCTEZ_CLIENT = os.environ.get("OCTEZ_CLIENT", "octez-client")
+
+CONTRACT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Escrow.py")
+
+# Compiled targets, keyed by compileKey. ESCROW_COMPILE_CACHE="" disables it.
+COMPILE_CACHE = os.environ.get("ESCROW_COMPILE_CACHE", os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "escrow", "compile"))
+
+# Address the compilation targets are built with. It is swapped for the
+# mockup's admin account before origination.
+MASTER = "tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"
+
+ACCOUNTS = {
+    "admin": ("bootstrap1", "tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx"),
+    "owner": ("bootstrap2", "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN"),
+    "counterparty": ("bootstrap3", "tz1faswCTDciRzE4oJ9jn2Vm2dvjeyA9fUzU"),
+}
+
+
+def string(value):
+    return '"%s"' % value
+
+
+def record(**fields):
+    """Michelson literal of a record in SmartPy's default layout: fields
+    sorted by name and paired as a balanced binary tree."""
+    values = [fields[name] for name in sorted(fields)]
+
+    def tree(values):
+        if len(values) == 1:
+            return str(values[0])
+        middle = len(values) // 2
+        return "(Pair %s %s)" % (tree(values[:middle]), tree(values[middle:]))
+
+    return tree(values)
+
+
+def hashedSecret(secret):
+    """Michelson literal of blake2b(pack(secret)) for a string secret."""
+    data = secret.encode()
+    packed = b"\x05\x01" + len(data).to_bytes(4, "big") + data
+    return "0x" + hashlib.blake2b(packed, digest_size=32).hexdigest()
+
+
+def requireTool(path, variable):
+    """Exit with a readable message when the tool at `path` is missing."""
+    if shutil.which(path) is None:
+        raise SystemExit("%s not found; set %s to its location." %
+                         (path, variable))
+
+
+def compileKey(source, options=()):
+    """Digest of everything a compilation depends on: the source, the CLI
+    options and the installed SmartPy CLI, identified by its files' sizes and
+    modification times."""
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        digest.update(f.read())
+    digest.update(repr(list(options)).encode())
+
+    cli = os.path.realpath(SMARTPY_CLI)
+    digest.update(cli.encode())
+    cliDir = os.path.dirname(cli)
+    for name in sorted(os.listdir(cliDir)):
+        stat = os.stat(os.path.join(cliDir, name))
+        digest.update(("%s %d %d" % (name, stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+def compileTargets(source, outputDir, options=(), cache=True):
+    """Compile every target of `source` into `outputDir` and return
+    {name: (code, storage)}.
+
+    The CLI compiles into a fresh directory, so only the targets of this
+    compilation are returned and cached, whatever `outputDir` held before.
+    The artifacts (code, storage, types) are kept in COMPILE_CACHE and
+    reused when neither the source, the options nor the SmartPy CLI changed
+    since."""
+    requireTool(SMARTPY_CLI, "SMARTPY_CLI")
+    cacheDir = None
+    if cache and COMPILE_CACHE:
+        cacheDir = os.path.join(COMPILE_CACHE, compileKey(source, options))
+
+    fresh = None
+    if cacheDir is not None and os.path.isdir(cacheDir):
+        compiled = cacheDir
+    else:
+        if cacheDir is not None:
+            # Compiled under a temporary name first, so that an interrupted
+            # run never leaves a partial entry behind.
+            os.makedirs(COMPILE_CACHE, exist_ok=True)
+            fresh = tempfile.mkdtemp(dir=COMPILE_CACHE)
+        else:
+            fresh = tempfile.mkdtemp()
+        subprocess.run([SMARTPY_CLI, "compile", source, fresh] +
+                       list(options), check=True, stdout=subprocess.DEVNULL)
+        compiled = fresh
+        if cacheDir is not None:
+            try:
+                os.rename(fresh, cacheDir)
+                compiled, fresh = cacheDir, None
+            except OSError:
+                # Another run cached the same key meanwhile.
+                pass
+
+    try:
+        os.makedirs(outputDir, exist_ok=True)
+        targets = {}
+        for name in sorted(os.listdir(compiled)):
+            artifact = os.path.join(compiled, name)
+            target = os.path.join(outputDir, name)
+            if not os.path.isdir(artifact):
+                shutil.copy2(artifact, target)
+                continue
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            shutil.copytree(artifact, target)
+            code = os.path.join(target, "step_000_cont_0_contract.tz")
+            storage = os.path.join(target, "step_000_cont_0_storage.tz")
+            if os.path.exists(code):
+                targets[name] = (code, storage)
+        return targets
+    finally:
+        if fresh is not None:
+            shutil.rmtree(fresh)
+
+
+def entrypointDepths(code):
+    """{entrypoint: depth of its branch in the `or` tree}, read from the
+    parameter type of a compiled script."""
+    with open(code) as f:
+        text = f.read()
+    tokens = re.findall(r"[();]|[^\s();]+", text[text.index("parameter"):])[1:]
+
+    def parse(position):
+        # A type as [primitive, annotations..., arguments...].
+        if tokens[position] != "(":
+            return [tokens[position]], position + 1
+        node, position = [], position + 1
+        while tokens[position] != ")":
+            if tokens[position] == "(":
+                child, position = parse(position)
+            else:
+                child, position = tokens[position], position + 1
+            node.append(child)
+        return node, position + 1
+
+    def walk(node, depth, depths):
+        names = [token[1:] for token in node[1:]
+                 if isinstance(token, str) and token.startswith("%")]
+        if names:
+            depths[names[0]] = depth
+        elif node[0] == "or":
+            for child in node[1:]:
+                if isinstance(child, list):
+                    walk(child, depth + 1, depths)
+        return depths
+
+    if tokens[0] == "(":
+        parameter, _ = parse(0)
+    else:
+        parameter = tokens[:tokens.index(";")]
+    return walk(parameter, 0, {})
+
+
+def parseReceipt(output):
+    gas = sum(float(value)
+              for value in re.findall(r"Consumed gas: ([\d.]+)", output))
+    paid = sum(int(value) for value in re.findall(
+        r"Paid storage size diff: (\d+) bytes", output))
+    size = re.findall(r"Storage size: (\d+) bytes", output)
+    return dict(
+        gas=gas,
+        paidStorage=paid,
+        storageSize=int(size[-1]) if size else None,
+    )
+
+
+class Mockup:
+    def __init__(self, baseDir):
+        requireTool(OCTEZ_CLIENT, "OCTEZ_CLIENT")
+        self.baseDir = baseDir
+        self.client("create", "mockup")
+
+    def client(self, *args):
+        result = subprocess.run(
+            [OCTEZ_CLIENT, "--mode", "mockup", "--base-dir", self.baseDir] +
+            list(args),
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr or result.stdout)
+        return result.stdout
+
+    def originate(self, name, code, storage):
+        with open(storage) as f:
+            initialStorage = f.read().replace(MASTER, ACCOUNTS["admin"][1])
+        output = self.client(
+            "originate", "contract", name, "transferring", "0",
+            "from", ACCOUNTS["admin"][0], "running", code,
+            "--init", initialStorage, "--burn-cap", "100", "--force")
+        receipt = parseReceipt(output)
+        receipt["scriptSize"] = self.scriptSize(code)
+        return receipt
+
+    def scriptSize(self, code):
+        """Size in bytes of the binary encoding of a compiled script."""
+        output = self.client("convert", "script", code,
+                             "from", "michelson", "to", "binary").strip()
+        return len(output[2:] if output.startswith("0x") else output) // 2
+
+    def dataSize(self, data):
+        """Size in bytes of the binary encoding of a Michelson value."""
+        output = self.client("convert", "data", data,
+                             "from", "michelson", "to", "binary").strip()
+        return len(output[2:] if output.startswith("0x") else output) // 2
+
+    def call(self, name, entrypoint, arg, sender, amount=0):
+        output = self.client(
+            "transfer", str(amount), "from", ACCOUNTS[sender][0], "to", name,
+            "--entrypoint", entrypoint, "--arg", arg, "--burn-cap", "10")
+        return parseReceipt(output)
+
+
+# Targets whose commissions are keyed by the on-chain counter. Their calls
+# address commissions by the order they were posted in instead of by name.
+COUNTER_TARGETS = {"escrow_counter"}
+
+
+class Keys:
+    def __init__(self, counterIds=False):
+        self.counterIds = counterIds
+        self.posted = []
+
+    def post(self, transactionId):
+        self.posted.append(transactionId)
+        if self.counterIds:
+            return "None"
+        return "(Some %s)" % string(transactionId)
+
+    def __call__(self, transactionId):
+        if self.counterIds:
+            return str(self.posted.index(transactionId))
+        return string(transactionId)
+
+
+def commission(keys, transactionId, offer=10, fee=1, duration=3600, descriptionLength=None):
+    description = "Benchmark commission %s" % transactionId
+    if descriptionLength is not None:
+        description = (description * descriptionLength)[:descriptionLength]
+    return record(
+        transactionId=keys.post(transactionId),
+        offer=offer * 1000000,
+        fee=fee * 1000000,
+        duration=duration,
+        secret=string("secret"),
+        description=string(description),
+        title=string("Benchmark"),
+    )
+
+
+def fund(keys, transactionId, offer=10, fee=1, descriptionLength=None):
+    post = commission(keys, transactionId, offer, fee,
+                      descriptionLength=descriptionLength)
+    key = keys(transactionId)
+    return [
+        ("postCommission", post, "owner", 0),
+        ("acceptCommission", key, "counterparty", 0),
+        ("depositOwner", key, "owner", offer),
+        ("depositCounterparty", key, "counterparty", fee),
+        ("approveCommission", key, "owner", 0),
+    ]
+
+
+def lifecycle(counterIds=False, descriptionLength=None):
+    """Calls replayed against every target, as
+    (entrypoint, Michelson argument, sender role, amount in tez)."""
+    keys = Keys(counterIds)
+    options = dict(descriptionLength=descriptionLength)
+
+    return fund(keys, "claimed", **options) + [
+        ("claimCounterparty", record(
+            transactionId=keys("claimed"),
+            secret="(Some %s)" % string("secret"),
+        ), "counterparty", 0),
+    ] + fund(keys, "expired", **options) + [
+        ("setTransactionEpoch", record(
+            transactionId=keys("expired"), epoch=0), "admin", 0),
+        ("claimOwner", keys("expired"), "owner", 0),
+    ] + fund(keys, "cancelled", **options) + [
+        ("cancelCommissionOwner", keys("cancelled"), "owner", 0),
+        ("cancelCommissionCounterparty", keys("cancelled"), "counterparty", 0),
+        ("revertCommissionFunds", keys("cancelled"), "admin", 0),
+    ]
+
+
+def benchmark(name, code, storage, steps):
+    with tempfile.TemporaryDirectory() as baseDir:
+        mockup = Mockup(baseDir)
+        results = [("origination", mockup.originate(name, code, storage))]
+        for entrypoint, arg, sender, amount in steps:
+            results.append(
+                (entrypoint, mockup.call(name, entrypoint, arg, sender, amount)))
+    return results
+
+
+def printTable(reports, metric):
+    names = list(reports)
+    baseline = reports[names[0]]
+    print("%-30s" % metric + "".join("%16s" % name for name in names))
+    for index, (entrypoint, result) in enumerate(baseline):
+        row = "%-30s%16s" % (entrypoint, result[metric])
+        for name in names[1:]:
+            value = reports[name][index][1][metric]
+            row += "%16s" % ("%s (%+g)" % (value, value - result[metric]))
+        print(row)
+    print()
+
+
+def printSizes(compiled, names):
+    with tempfile.TemporaryDirectory() as baseDir:
+        mockup = Mockup(baseDir)
+        sizes = [mockup.scriptSize(compiled[name][0]) for name in names]
+    print("%-30s%16s" % ("target", "script size"))
+    for name, size in zip(names, sizes):
+        print("%-30s%16s" % (name, "%d (%+d)" % (size, size - sizes[0])))
+
+
+def printDepths(compiled, names):
+    depths = {name: entrypointDepths(compiled[name][0]) for name in names}
+    baseline = depths[names[0]]
+    print("%-30s" % "depth" + "".join("%16s" % name for name in names))
+    for entrypoint in sorted(baseline, key=lambda e: (baseline[e], e)):
+        row = "%-30s%16s" % (entrypoint, baseline[entrypoint])
+        for name in names[1:]:
+            depth = depths[name][entrypoint]
+            row += "%16s" % ("%d (%+d)" % (depth, depth - baseline[entrypoint]))
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("targets", nargs="*",
+                        default=["escrow", "escrow_merged"])
+    parser.add_argument("--description-lengths", type=int, nargs="+",
+                        default=[None], metavar="LENGTH",
+                        help="rerun the lifecycle with descriptions of "
+                             "each length")
+    parser.add_argument("--sizes", action="store_true",
+                        help="only compare the script sizes")
+    parser.add_argument("--depths", action="store_true",
+                        help="only compare the depth of every entrypoint "
+                             "in the parameter type")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as outputDir:
+        compiled = compileTargets(CONTRACT, outputDir)
+        if args.sizes:
+            printSizes(compiled, args.targets)
+            return
+        if args.depths:
+            printDepths(compiled, args.targets)
+            return
+        for descriptionLength in args.description_lengths:
+            reports = {}
+            for name in args.targets:
+                code, storage = compiled[name]
+                steps = lifecycle(name in COUNTER_TARGETS, descriptionLength)
+                reports[name] = benchmark(name, code, storage, steps)
+
+            if descriptionLength is not None:
+                print("== description length %d ==" % descriptionLength)
+            for name, results in reports.items():
+                print("%s: script size %d bytes" %
+                      (name, results[0][1]["scriptSize"]))
+            print()
+            printTable(reports, "gas")
+            printTable(reports, "paidStorage")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Per-entrypoint cost suite for Escrow, with regression thresholds.
+
+Every entrypoint of a compilation target is called under fixed inputs in an
+octez-client mockup (see benchmark.py). The consumed gas, the paid storage
+diff and the size of the binary-encoded parameter of each call are written to
+a JSON report, and compared with the baseline in contract/costs.json when
+asked to:
+
+    python contract/benchmark_suite.py --report costs.json
+    python contract/benchmark_suite.py --baseline contract/costs.json
+    python contract/benchmark_suite.py --write-baseline contract/costs.json
+
+The second form runs the targets of the baseline and exits with status 1
+when a call costs more than its baseline allows under the thresholds of the
+baseline file, or when a target has no recorded costs yet. The last form
+records the current costs, keeping the thresholds of the file.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmark import (ACCOUNTS, CONTRACT, COUNTER_TARGETS, Keys, Mockup,
+                       commission, compileTargets, hashedSecret, record,
+                       string)
+
+# Regressions accepted against a baseline that does not set its own: gas in
+# percent, paid storage and sizes in bytes.
+THRESHOLDS = dict(gasPercent=0, paidStorageBytes=0, sizeBytes=0)
+
+# Cases of TTransactionUpdate in the order of its default layout.
+UPDATE_CASES = ["counterparty", "duration", "epoch", "fee",
+                "offer", "owner", "secret", "status"]
+
+
+def variant(cases, case, value):
+    """Michelson literal of a variant in SmartPy's default layout: cases
+    sorted by name and nested as a balanced binary tree."""
+    if len(cases) == 1:
+        return str(value)
+    middle = len(cases) // 2
+    if case in cases[:middle]:
+        return "(Left %s)" % variant(cases[:middle], case, value)
+    return "(Right %s)" % variant(cases[middle:], case, value)
+
+
+def michelsonList(items):
+    return "{ %s }" % "; ".join(items)
+
+
+def calls(counterIds=False):
+    """Calls covering every entrypoint of a default build, as
+    (entrypoint, Michelson argument, sender role, amount in tez). The last
+    one, resetEscrow, clears the contract."""
+    keys = Keys(counterIds)
+    owner, counterparty = ACCOUNTS["owner"][1], ACCOUNTS["counterparty"][1]
+
+    def batchEntry(transactionId):
+        fields = dict(
+            transactionId=keys.post(transactionId) if counterIds
+            else string(transactionId),
+            offer=10 * 1000000,
+            fee=1 * 1000000,
+            duration=3600,
+            hashedSecret=hashedSecret("secret"),
+            description=string("Benchmark commission %s" % transactionId),
+            title=string("Benchmark"),
+        )
+        return record(**fields)
+
+    steps = [
+        # Owner edits of a pending commission.
+        ("postCommission", commission(keys, "edited"), "owner", 0),
+        ("editCommisionReward", record(
+            transactionId=keys("edited"), newFromOwner=10 * 1000000), "owner", 0),
+        ("editCommisionFee", record(
+            transactionId=keys("edited"), newFromCounterparty=1 * 1000000), "owner", 0),
+        ("editCommisionDetails", record(
+            transactionId=keys("edited"), newDetails=string("Edited")), "owner", 0),
+        ("editCommisionDuration", record(
+            transactionId=keys("edited"), newDuration=3600), "owner", 0),
+        ("editCommisionSecret", record(
+            transactionId=keys("edited"), newSecret=string("secret")), "owner", 0),
+        ("acceptCommission", keys("edited"), "counterparty", 0),
+        ("leaveCommission", keys("edited"), "counterparty", 0),
+        ("acceptCommission", keys("edited"), "counterparty", 0),
+        ("depositOwner", keys("edited"), "owner", 10),
+        ("depositCounterparty", keys("edited"), "counterparty", 1),
+        ("approveCommission", keys("edited"), "owner", 0),
+        ("claimCounterparty", record(
+            transactionId=keys("edited"),
+            secret="(Some %s)" % string("secret"),
+        ), "counterparty", 0),
+
+        # Fast path and expiry.
+        ("postAndDeposit", commission(keys, "fast"), "owner", 10),
+        ("acceptAndDeposit", keys("fast"), "counterparty", 1),
+        ("activateCommission", keys("fast"), "owner", 0),
+        ("setTransactionEpoch", record(
+            transactionId=keys("fast"), epoch=0), "admin", 0),
+        ("claimOwner", keys("fast"), "owner", 0),
+
+        # Batches and a mutual cancellation.
+        ("postCommissions", michelsonList(
+            [batchEntry("cancelled"), batchEntry("administered")]), "owner", 0),
+        ("acceptCommission", keys("cancelled"), "counterparty", 0),
+        ("acceptCommission", keys("administered"), "counterparty", 0),
+        ("depositOwnerBatch", michelsonList(
+            [keys("cancelled"), keys("administered")]), "owner", 20),
+        ("depositCounterpartyBatch", michelsonList(
+            [keys("cancelled"), keys("administered")]), "counterparty", 2),
+        ("approveCommission", keys("cancelled"), "owner", 0),
+        ("cancelCommissionOwner", keys("cancelled"), "owner", 0),
+        ("cancelCommissionCounterparty", keys("cancelled"), "counterparty", 0),
+        ("revertCommissionFunds", keys("cancelled"), "admin", 0),
+
+        # Admin setters.
+        ("setTransactionDuration", record(
+            transactionId=keys("administered"), duration=7200), "admin", 0),
+        ("setTransactionFromOwner", record(
+            transactionId=keys("administered"), offer=10 * 1000000), "admin", 0),
+        ("setTransactionFromCounterparty", record(
+            transactionId=keys("administered"), fee=1 * 1000000), "admin", 0),
+        ("setTransactionHashedSecret", record(
+            transactionId=keys("administered"), secret=string("secret")), "admin", 0),
+        ("setTransactionOwner", record(
+            transactionId=keys("administered"), owner=string(owner)), "admin", 0),
+        ("setTransactionCounterparty", record(
+            transactionId=keys("administered"),
+            counterparty=string(counterparty)), "admin", 0),
+        ("setCommissionStatus", record(
+            transactionId=keys("administered"), status=0), "admin", 0),
+        ("updateTransactions", michelsonList([record(
+            transactionId=keys("administered"),
+            updates=michelsonList([
+                variant(UPDATE_CASES, "duration", 3600),
+                variant(UPDATE_CASES, "epoch", 0),
+            ]),
+        )]), "admin", 0),
+
+        # Admin created commission.
+        ("createCommission", keys.post("created"), "admin", 0),
+        ("setCommissionParticipants", record(
+            transactionId=keys("created"),
+            owner=string(owner),
+            counterparty=string(counterparty),
+        ), "admin", 0),
+        ("setCommissionDetails", record(
+            transactionId=keys("created"),
+            owner=string(owner),
+            counterparty=string(counterparty),
+            duration=3600,
+            offer=10 * 1000000,
+            fee=1 * 1000000,
+            secret=string("secret"),
+            description=string("Benchmark commission created"),
+            title=string("Benchmark"),
+        ), "admin", 0),
+        ("setCommissionStatus", record(
+            transactionId=keys("created"), status=-1), "admin", 0),
+        ("deleteCommission", keys("created"), "owner", 0),
+
+        ("resetEscrow", "Unit", "admin", 0),
+    ]
+    return steps
+
+
+def label(steps):
+    """Unique report keys: repeated entrypoints get a #n suffix."""
+    seen = {}
+    labels = []
+    for entrypoint, _, _, _ in steps:
+        seen[entrypoint] = seen.get(entrypoint, 0) + 1
+        labels.append(entrypoint if seen[entrypoint] == 1
+                      else "%s#%d" % (entrypoint, seen[entrypoint]))
+    return labels
+
+
+def run(name, code, storage):
+    steps = calls(name in COUNTER_TARGETS)
+    with tempfile.TemporaryDirectory() as baseDir:
+        mockup = Mockup(baseDir)
+        origination = mockup.originate(name, code, storage)
+        report = {"origination": dict(
+            gas=origination["gas"],
+            paidStorage=origination["paidStorage"],
+            scriptSize=origination["scriptSize"],
+        )}
+        for key, (entrypoint, arg, sender, amount) in zip(label(steps), steps):
+            receipt = mockup.call(name, entrypoint, arg, sender, amount)
+            report[key] = dict(
+                entrypoint=entrypoint,
+                gas=receipt["gas"],
+                paidStorage=receipt["paidStorage"],
+                parameterSize=mockup.dataSize(arg),
+            )
+    return report
+
+
+def loadBaseline(path):
+    """{"thresholds": {...}, "costs": {target: report}} of a baseline file,
+    or an empty baseline when the file does not exist."""
+    baseline = dict(thresholds=dict(THRESHOLDS), costs={})
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        baseline["thresholds"].update(saved.get("thresholds", {}))
+        baseline["costs"].update(saved.get("costs", {}))
+    return baseline
+
+
+def regressions(reports, baseline):
+    """Calls costing more than their baseline allows, as printable lines."""
+    thresholds = baseline["thresholds"]
+    found = []
+    for target, costs in baseline["costs"].items():
+        report = reports.get(target)
+        if report is None:
+            continue
+        if not costs:
+            found.append("%s: no baseline costs recorded, run with "
+                         "--write-baseline" % target)
+        for key, expected in costs.items():
+            actual = report.get(key)
+            if actual is None:
+                found.append("%s %s: missing from the report" % (target, key))
+                continue
+            limit = expected["gas"] * (1 + thresholds["gasPercent"] / 100)
+            if actual["gas"] > limit:
+                found.append("%s %s: gas %s > %s (baseline %s)" % (
+                    target, key, actual["gas"], round(limit, 3), expected["gas"]))
+            for cost, threshold in [("paidStorage", "paidStorageBytes"),
+                                    ("parameterSize", "sizeBytes"),
+                                    ("scriptSize", "sizeBytes")]:
+                if cost not in expected:
+                    continue
+                limit = expected[cost] + thresholds[threshold]
+                if actual[cost] > limit:
+                    found.append("%s %s: %s %d > %d bytes (baseline %d)" % (
+                        target, key, cost, actual[cost], limit, expected[cost]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("targets", nargs="*",
+                        help="compilation targets to run, by default those "
+                             "of the baseline, or escrow")
+    parser.add_argument("--report", help="write the costs to this JSON file")
+    parser.add_argument("--baseline",
+                        help="fail when a cost regresses against this file")
+    parser.add_argument("--write-baseline", metavar="FILE",
+                        help="record the costs in this baseline file")
+    parser.add_argument("--gas-tolerance", type=float, metavar="PERCENT",
+                        help="gas increase accepted against the baseline, "
+                             "instead of its gasPercent threshold")
+    args = parser.parse_args()
+
+    baseline = loadBaseline(args.baseline) if args.baseline else None
+    if args.gas_tolerance is not None and baseline is not None:
+        baseline["thresholds"]["gasPercent"] = args.gas_tolerance
+    targets = args.targets
+    if not targets:
+        targets = sorted(baseline["costs"]) if baseline else []
+    targets = targets or ["escrow"]
+
+    with tempfile.TemporaryDirectory() as outputDir:
+        compiled = compileTargets(CONTRACT, outputDir)
+        reports = {name: run(name, *compiled[name]) for name in targets}
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(reports, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.write_baseline:
+        recorded = loadBaseline(args.write_baseline)
+        recorded["costs"].update(reports)
+        with open(args.write_baseline, "w") as f:
+            json.dump(recorded, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    for name, report in reports.items():
+        print(name)
+        for key, costs in report.items():
+            print("  %-36s gas %10s  paid storage %6s" %
+                  (key, costs["gas"], costs["paidStorage"]))
+
+    if baseline is not None:
+        found = regressions(reports, baseline)
+        for line in found:
+            print("REGRESSION " + line, file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
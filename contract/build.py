@@ -0,0 +1,50 @@
+"""Compile the Escrow contracts for deployment, reusing cached artifacts.
+
+Every compilation target of contract/Escrow.py, and of the older layout in
+contract/test.py, is written under the output directory. Unchanged sources
+are not recompiled (see compileTargets in benchmark.py):
+
+    python contract/build.py build/contracts
+    python contract/build.py build/contracts --no-cache
+    python contract/build.py --clear-cache
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+from benchmark import COMPILE_CACHE, CONTRACT, compileTargets
+
+SOURCES = [CONTRACT, os.path.join(os.path.dirname(CONTRACT), "test.py")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("output", nargs="?")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompile even if the artifacts are cached")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="remove every cached artifact")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        if COMPILE_CACHE:
+            shutil.rmtree(COMPILE_CACHE, ignore_errors=True)
+        if args.output is None:
+            return
+    if args.output is None:
+        parser.error("the output directory is required")
+
+    for source in SOURCES:
+        outputDir = os.path.join(
+            args.output, os.path.splitext(os.path.basename(source))[0])
+        start = time.perf_counter()
+        targets = compileTargets(source, outputDir, cache=not args.no_cache)
+        print("%s: %d targets in %.2fs -> %s" % (
+            os.path.basename(source), len(targets),
+            time.perf_counter() - start, outputDir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Gas, storage and script-size comparison of two Escrow layouts.
+
+The benchmark lifecycle of benchmark.py is written against the entrypoints of
+contract/Escrow.py. Here it is replayed against a compilation target of two
+source files, translating each call for contracts whose entrypoints differ
+(see MAPPINGS), and the costs are printed per entrypoint of the lifecycle,
+relative to the first source:
+
+    python contract/compare.py
+    python contract/compare.py contract/test.py contract/Escrow.py --target escrow
+"""
+
+import argparse
+import os
+import tempfile
+
+from benchmark import CONTRACT, Mockup, compileTargets, lifecycle, printTable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEGACY = os.path.join(HERE, "test.py")
+
+# Calls of the older layout in contract/test.py doing the work of an
+# Escrow.py entrypoint. Its commissions only leave the pending state through
+# activateTransaction, which approveCommission and claims then require.
+LEGACY_ENTRYPOINTS = dict(
+    createCommission=["createTransaction"],
+    setCommissionDetails=["setTransactionDetails"],
+    setCommissionParticipants=["setTransactionParticipants"],
+    activateCommission=["activateTransaction"],
+    approveCommission=["activateTransaction", "approveCommission"],
+)
+
+# Entrypoint translations by source file name. Sources not listed take the
+# lifecycle calls unchanged.
+MAPPINGS = {
+    "test.py": LEGACY_ENTRYPOINTS,
+}
+
+
+def translate(steps, mapping):
+    """Group the calls standing in for each lifecycle step."""
+    return [
+        (entrypoint, [(name, arg, sender, amount if index == 0 else 0)
+                      for index, name in enumerate(
+                          mapping.get(entrypoint, [entrypoint]))])
+        for entrypoint, arg, sender, amount in steps
+    ]
+
+
+def total(receipts):
+    return dict(
+        gas=round(sum(receipt["gas"] for receipt in receipts), 3),
+        paidStorage=sum(receipt["paidStorage"] for receipt in receipts),
+        storageSize=receipts[-1]["storageSize"],
+    )
+
+
+def run(name, code, storage, groups):
+    with tempfile.TemporaryDirectory() as baseDir:
+        mockup = Mockup(baseDir)
+        results = [("origination", mockup.originate(name, code, storage))]
+        for entrypoint, calls in groups:
+            results.append((entrypoint, total([
+                mockup.call(name, *call) for call in calls])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("before", nargs="?", default=LEGACY)
+    parser.add_argument("after", nargs="?", default=CONTRACT)
+    parser.add_argument("--target", default="escrow",
+                        help="compilation target built from both sources")
+    args = parser.parse_args()
+
+    reports = {}
+    for source in [args.before, args.after]:
+        label = os.path.basename(source)
+        if label in reports:
+            label = os.path.relpath(source)
+        mapping = MAPPINGS.get(os.path.basename(source), {})
+        with tempfile.TemporaryDirectory() as outputDir:
+            code, storage = compileTargets(source, outputDir)[args.target]
+            reports[label] = run(args.target, code, storage,
+                                 translate(lifecycle(), mapping))
+
+    sizes = [results[0][1]["scriptSize"] for results in reports.values()]
+    print("%-30s" % "script size" + "".join("%16s" % label for label in reports))
+    print("%-30s%16s%16s" % ("", sizes[0], "%d (%+d)" % (sizes[1], sizes[1] - sizes[0])))
+    print()
+    printTable(reports, "gas")
+    printTable(reports, "paidStorage")
+    printTable(reports, "storageSize")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Differential test of contract/model.py against the SmartPy contract.
+
+Traces sampled by the model are replayed as a SmartPy scenario against
+Escrow(master). Every call must succeed or fail as in the model, with the
+same failure message, and the touched commission, the aggregate counters and
+the contract balance must match the model after each call. Run from the
+repository root:
+
+    ~/smartpy-cli/SmartPy.sh test contract/differential.py output
+"""
+
+import random
+
+import smartpy as sp
+
+# Imported under a templates name, so that the scenarios and compilation
+# targets of Escrow.py are not run again with every differential run.
+Escrow = sp.io.import_script_from_url(
+    "file:contract/Escrow.py", name="templates/Escrow").Escrow
+model = sp.io.import_script_from_url("file:contract/model.py")
+
+SEEDS = range(8)
+TRACE_LENGTH = 60
+
+
+def arguments(entrypoint, args):
+    """SmartPy arguments of a model call: the commission ID alone, or the
+    keyword arguments of a record parameter."""
+    values = dict(zip(model.PARAMETERS[entrypoint], args))
+    if entrypoint == "postCommission":
+        values.update(
+            transactionId=sp.some(values["transactionId"]),
+            offer=sp.mutez(values["offer"]),
+            fee=sp.mutez(values["fee"]),
+        )
+    elif entrypoint == "claimCounterparty":
+        values.update(secret=sp.some(values["secret"]))
+    else:
+        return values["transactionId"]
+    return values
+
+
+def verifyParty(scenario, party, expected):
+    if expected is None:
+        scenario.verify(~party.is_some())
+    else:
+        scenario.verify(party == sp.some(sp.address(expected)))
+
+
+def verifyTransaction(scenario, c1, reference, transactionId):
+    expected = reference.transactions.get(transactionId)
+    if expected is None:
+        scenario.verify(~c1.data.transactions.contains(transactionId))
+        scenario.verify(~c1.data.parties.contains(transactionId))
+        return
+
+    parties = c1.data.parties[transactionId]
+    verifyParty(scenario, parties.owner, expected.owner)
+    verifyParty(scenario, parties.counterparty, expected.counterparty)
+
+    transaction = c1.data.transactions[transactionId]
+    scenario.verify(transaction.status == expected.status)
+    scenario.verify(transaction.offer == sp.mutez(expected.offer))
+    scenario.verify(transaction.fee == sp.mutez(expected.fee))
+    scenario.verify(transaction.balanceOwner == sp.mutez(expected.balanceOwner))
+    scenario.verify(transaction.balanceCounterparty ==
+                    sp.mutez(expected.balanceCounterparty))
+    scenario.verify(transaction.epoch == sp.timestamp(expected.epoch))
+    scenario.verify(transaction.duration == expected.duration)
+    scenario.verify(transaction.hashedSecret ==
+                    sp.some(sp.blake2b(sp.pack(expected.secret))))
+    scenario.verify(transaction.ownerHasWithdrawn == expected.ownerHasWithdrawn)
+    scenario.verify(transaction.counterpartyHasWithdrawn ==
+                    expected.counterpartyHasWithdrawn)
+
+
+def verifyTotals(scenario, c1, reference):
+    for name in model.Stats.__slots__:
+        value = getattr(reference.stats, name)
+        if name == "totalLocked":
+            value = sp.mutez(value)
+        scenario.verify(getattr(c1.data.stats, name) == value)
+    scenario.verify(c1.balance == sp.mutez(reference.balance))
+
+
+@sp.add_test(name="EscrowModel")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Escrow against its reference model")
+
+    for seed in SEEDS:
+        scenario.h2("Trace %d" % seed)
+        c1 = Escrow(sp.address(model.ADMIN), stats=True)
+        scenario += c1
+        reference = model.Escrow(model.ADMIN)
+
+        trace = model.sampleTrace(random.Random(seed), TRACE_LENGTH)
+        for entrypoint, sender, amount, now, args in trace:
+            try:
+                reference.apply((entrypoint, sender, amount, now, args))
+                expected = dict(valid=True)
+            except model.EscrowError as error:
+                expected = dict(valid=False)
+                if error.message is not None:
+                    expected.update(exception=error.message)
+
+            params = arguments(entrypoint, args)
+            if isinstance(params, dict):
+                call = getattr(c1, entrypoint)(**params)
+            else:
+                call = getattr(c1, entrypoint)(params)
+            scenario += call.run(
+                sender=sp.address(sender),
+                amount=sp.mutez(amount),
+                now=sp.timestamp(now),
+                **expected
+            )
+            if expected["valid"]:
+                verifyTransaction(scenario, c1, reference, args[0])
+                verifyTotals(scenario, c1, reference)
+
+        for transactionId in sorted(reference.transactions):
+            verifyTransaction(scenario, c1, reference, transactionId)
@@ -0,0 +1,86 @@
+"""Code to message table of the Escrow failures.
+
+Builds of contract/Escrow.py made with errorCodes=True fail with the nat codes
+of its ERRORS table instead of the messages. The table is read from the source
+without importing SmartPy, and can be exported for the frontend:
+
+    python contract/errors.py                  # writes src/utils/errors.js
+    python contract/errors.py --check          # fails if errors.js is stale
+    python contract/errors.py --message 12     # Transaction does not exist.
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONTRACT = os.path.join(HERE, "Escrow.py")
+ERRORS_JS = os.path.join(HERE, os.pardir, "src", "utils", "errors.js")
+
+
+def loadErrors(source=CONTRACT):
+    """The ERRORS table of `source` as {code: message}."""
+    with open(source) as f:
+        tree = ast.parse(f.read(), source)
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                getattr(node.targets[0], "id", None) == "ERRORS"):
+            return ast.literal_eval(node.value)
+    raise ValueError("No ERRORS table in %s" % source)
+
+
+ERRORS = loadErrors()
+
+
+def message(code):
+    """The message of a failure code, or the failure itself when it is not
+    a known code (builds without errorCodes fail with the message)."""
+    try:
+        return ERRORS[int(code)]
+    except (KeyError, ValueError):
+        return code
+
+
+def renderJs(errors):
+    table = json.dumps({str(code): text for code, text in errors.items()},
+                       indent=2, ensure_ascii=False)
+    return (
+        "// Generated by contract/errors.py from the ERRORS table of\n"
+        "// contract/Escrow.py. Do not edit.\n"
+        "\n"
+        "export const errors = %s;\n"
+        "\n"
+        "// Message of a failure raised by a build with errorCodes=True.\n"
+        "// Failures of other builds are already messages.\n"
+        "export const errorMessage = (code) => errors[code] || code;\n"
+    ) % table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", default=ERRORS_JS)
+    parser.add_argument("--check", action="store_true",
+                        help="fail if the output is not up to date")
+    parser.add_argument("--message", metavar="CODE",
+                        help="print the message of a code")
+    args = parser.parse_args()
+
+    if args.message is not None:
+        print(message(args.message))
+        return
+
+    rendered = renderJs(ERRORS)
+    if args.check:
+        with open(args.output) as f:
+            if f.read() != rendered:
+                sys.exit("%s is out of date, run contract/errors.py" %
+                         args.output)
+        return
+    with open(args.output, "w") as f:
+        f.write(rendered)
+
+
+if __name__ == "__main__":
+    main()
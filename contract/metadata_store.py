@@ -0,0 +1,85 @@
+"""File-backed stand-in for the off-chain store of commission metadata.
+
+With Escrow(master, offchainMetadata=True) a commission only keeps the
+blake2b-256 digest of its metadata and a short URI on-chain. This store keeps
+each document as a JSON file named after that digest, which is enough for
+tests and local development:
+
+    python contract/metadata_store.py .metadata put "Cat caretaker" "Feed my cat"
+    python contract/metadata_store.py .metadata get local://<digest>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+SCHEME = "local://"
+
+
+def encode(title, description):
+    """Canonical bytes of a commission's metadata document."""
+    return json.dumps(
+        dict(title=title, description=description),
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    ).encode("utf-8")
+
+
+def contentHash(document):
+    """The digest stored on-chain as `metadataHash`."""
+    return hashlib.blake2b(document, digest_size=32).digest()
+
+
+class MetadataStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest.hex() + ".json")
+
+    def put(self, title, description):
+        """Store a document and return its (metadataHash, metadataUri)."""
+        document = encode(title, description)
+        digest = contentHash(document)
+        with open(self.path(digest), "wb") as f:
+            f.write(document)
+        return digest, SCHEME + digest.hex()
+
+    def get(self, metadataUri, metadataHash=None):
+        """Load the document behind `metadataUri`, checking it against the
+        on-chain `metadataHash` when one is given."""
+        if not metadataUri.startswith(SCHEME):
+            raise ValueError("Unsupported metadata URI: %s" % metadataUri)
+        digest = bytes.fromhex(metadataUri[len(SCHEME):])
+
+        with open(self.path(digest), "rb") as f:
+            document = f.read()
+        if contentHash(document) != (metadataHash or digest):
+            raise ValueError("Metadata does not match its hash: %s" %
+                             metadataUri)
+        return json.loads(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    put = commands.add_parser("put")
+    put.add_argument("title")
+    put.add_argument("description")
+    get = commands.add_parser("get")
+    get.add_argument("uri")
+    args = parser.parse_args()
+
+    store = MetadataStore(args.directory)
+    if args.command == "put":
+        digest, uri = store.put(args.title, args.description)
+        print("metadataHash: 0x%s" % digest.hex())
+        print("metadataUri: %s" % uri)
+    else:
+        print(json.dumps(store.get(args.uri), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
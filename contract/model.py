@@ -0,0 +1,555 @@
+"""Plain-Python reference model of the default Escrow build.
+
+Escrow mirrors the storage and rules of Escrow(master) in contract/Escrow.py
+for the commission lifecycle: post, accept, leave, deposits, approval and
+activation, cancellations, reverts, claims and deletion. A call either fails
+with the message the contract fails with and leaves the model untouched, or
+applies its effects. It runs without SmartPy, fast enough to explore large
+numbers of random interleavings:
+
+    python contract/model.py --transitions 1000000
+    python contract/model.py --transitions 100000 --seed 7 --check
+
+contract/test_model.py checks the invariants along sampled traces, and
+contract/differential.py replays them through the SmartPy contract and
+checks that both agree.
+"""
+
+import argparse
+import random
+import time
+
+ADMIN = "tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf"
+OWNER = "tz1XzLbkKor5e41sQRJfUu1bg22tVG3qBDDq"
+COUNTERPARTY = "tz1QmCWR2fzy3niEDodkyjMS44aUVYyFWdTF"
+OUTSIDER = "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN"
+ACCOUNTS = (ADMIN, OWNER, COUNTERPARTY, OUTSIDER)
+
+STATUS_COUNTERS = {0: "pending", 1: "active", 2: "completed", -1: "cancelled"}
+
+# Arguments of the modelled entrypoints, in the order calls carry them.
+PARAMETERS = dict(
+    postCommission=("transactionId", "offer", "fee", "duration", "secret",
+                    "description", "title"),
+    acceptCommission=("transactionId",),
+    leaveCommission=("transactionId",),
+    depositOwner=("transactionId",),
+    depositCounterparty=("transactionId",),
+    approveCommission=("transactionId",),
+    activateCommission=("transactionId",),
+    cancelCommissionOwner=("transactionId",),
+    cancelCommissionCounterparty=("transactionId",),
+    revertCommissionFunds=("transactionId",),
+    claimCounterparty=("transactionId", "secret"),
+    claimOwner=("transactionId",),
+    deleteCommission=("transactionId",),
+)
+
+
+class EscrowError(Exception):
+    """A failed call. `message` is the contract's failure message, or None
+    for failures the contract does not name (a missing big_map key, an
+    open_some of None, an unfunded transfer)."""
+
+    def __init__(self, message=None):
+        super().__init__(message)
+        self.message = message
+
+
+class Transaction:
+    """A commission: the parties and transactions records of the contract
+    in a single record. `secret` stands for its hash."""
+
+    __slots__ = ("owner", "counterparty", "offer", "fee", "balanceOwner",
+                 "balanceCounterparty", "epoch", "duration", "secret",
+                 "ownerHasWithdrawn", "counterpartyHasWithdrawn", "status",
+                 "description", "title")
+
+    def __init__(self, owner, offer, fee, duration, secret, description, title):
+        self.owner = owner
+        self.counterparty = None
+        self.offer = offer
+        self.fee = fee
+        self.balanceOwner = 0
+        self.balanceCounterparty = 0
+        self.epoch = 0
+        self.duration = duration
+        self.secret = secret
+        self.ownerHasWithdrawn = False
+        self.counterpartyHasWithdrawn = False
+        self.status = 0
+        self.description = description
+        self.title = title
+
+
+class Stats:
+    __slots__ = ("pending", "active", "completed", "cancelled",
+                 "pendingReverts", "totalLocked")
+
+    def __init__(self):
+        self.pending = 0
+        self.active = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.pendingReverts = 0
+        self.totalLocked = 0
+
+
+def isPendingRevert(transaction):
+    return (transaction.ownerHasWithdrawn and
+            transaction.counterpartyHasWithdrawn and
+            transaction.status not in (2, -1))
+
+
+class Escrow:
+    """Storage of the contract, with amounts in mutez and timestamps in
+    seconds. Every entrypoint takes the sender, the attached amount and
+    the time of the call before its own arguments."""
+
+    __slots__ = ("master", "transactions", "stats", "balance", "entrypoints")
+
+    def __init__(self, master=ADMIN):
+        self.master = master
+        self.transactions = {}
+        self.stats = Stats()
+        self.balance = 0
+        self.entrypoints = {name: getattr(self, name) for name in PARAMETERS}
+
+    def apply(self, call):
+        """Run a call (entrypoint, sender, amount, now, arguments)."""
+        entrypoint, sender, amount, now, args = call
+        self.balance += amount
+        try:
+            self.entrypoints[entrypoint](sender, amount, now, *args)
+        except EscrowError:
+            self.balance -= amount
+            raise
+
+    ### helpers ###
+
+    def transactionOf(self, transactionId):
+        transaction = self.transactions.get(transactionId)
+        if transaction is None:
+            raise EscrowError("Transaction does not exist.")
+        return transaction
+
+    def verifyPending(self, transaction):
+        if transaction.status != 0:
+            raise EscrowError("Transaction is not pending.")
+
+    def setStatus(self, transaction, status):
+        stats = self.stats
+        pendingRevert = isPendingRevert(transaction)
+        setattr(stats, STATUS_COUNTERS[transaction.status],
+                getattr(stats, STATUS_COUNTERS[transaction.status]) - 1)
+        transaction.status = status
+        setattr(stats, STATUS_COUNTERS[status],
+                getattr(stats, STATUS_COUNTERS[status]) + 1)
+        stats.pendingReverts += isPendingRevert(transaction) - pendingRevert
+
+    def toggleWithdrawn(self, transaction, party):
+        pendingRevert = isPendingRevert(transaction)
+        if party == "owner":
+            transaction.ownerHasWithdrawn = not transaction.ownerHasWithdrawn
+        else:
+            transaction.counterpartyHasWithdrawn = not transaction.counterpartyHasWithdrawn
+        self.stats.pendingReverts += isPendingRevert(transaction) - pendingRevert
+
+    def pay(self, amount):
+        # The balance already includes the amount attached to the call.
+        if amount > self.balance:
+            raise EscrowError()
+        self.balance -= amount
+
+    def activate(self, transaction, now):
+        transaction.epoch = now + transaction.duration
+        self.setStatus(transaction, 1)
+
+    def settle(self, transaction, sender, identity, now):
+        if transaction.status != 1:
+            raise EscrowError("Transaction is not active.")
+        if (transaction.balanceOwner != transaction.offer or
+                transaction.balanceCounterparty != transaction.fee):
+            raise EscrowError("Both parties must deposit!")
+        if sender != identity:
+            raise EscrowError("Only the owner or counterparty can claim!")
+
+        locked = transaction.balanceOwner + transaction.balanceCounterparty
+        self.pay(locked)
+        self.stats.totalLocked -= locked
+        transaction.balanceOwner = 0
+        transaction.balanceCounterparty = 0
+        self.setStatus(transaction, 2)
+
+    ### owner interfaces ###
+
+    def postCommission(self, sender, amount, now, transactionId, offer, fee,
+                       duration, secret, description="", title=""):
+        if transactionId in self.transactions:
+            raise EscrowError("Transaction already exists.")
+        self.transactions[transactionId] = Transaction(
+            sender, offer, fee, duration, secret, description, title)
+        self.stats.pending += 1
+
+    def depositOwner(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        self.verifyPending(transaction)
+        if transaction.owner != sender:
+            raise EscrowError("Only the owner can deposit funds.")
+        if transaction.balanceOwner != 0:
+            raise EscrowError("Owner already deposited funds.")
+        if amount != transaction.offer:
+            raise EscrowError("Amount does not match offer.")
+
+        transaction.balanceOwner += transaction.offer
+        self.stats.totalLocked += transaction.offer
+
+    def activateCommission(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.owner is None:
+            raise EscrowError()
+        if sender != transaction.owner:
+            raise EscrowError("Only owner can start transaction.")
+        self.verifyPending(transaction)
+        if transaction.balanceOwner == 0 or transaction.balanceCounterparty == 0:
+            raise EscrowError("Both parties must deposit first!")
+
+        self.activate(transaction, now)
+
+    def approveCommission(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        self.verifyPending(transaction)
+        if transaction.balanceOwner != transaction.offer:
+            raise EscrowError("Owner did not deposit funds.")
+        if transaction.balanceCounterparty != transaction.fee:
+            raise EscrowError("Counterparty did not deposit funds.")
+        if transaction.owner is None:
+            raise EscrowError()
+        if sender != transaction.owner:
+            raise EscrowError("Only the owner can approve the commission.")
+
+        self.activate(transaction, now)
+
+    def cancelCommissionOwner(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.owner != sender:
+            raise EscrowError("Only the owner can cancel the commission.")
+
+        self.toggleWithdrawn(transaction, "owner")
+
+    def deleteCommission(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.owner != sender:
+            raise EscrowError("Only the owner can delete the commission.")
+        if transaction.status == 0:
+            raise EscrowError("Transaction is not pending.")
+
+        if transaction.balanceOwner != 0:
+            self.pay(transaction.balanceOwner)
+        stats = self.stats
+        counter = STATUS_COUNTERS[transaction.status]
+        setattr(stats, counter, getattr(stats, counter) - 1)
+        stats.pendingReverts -= isPendingRevert(transaction)
+        stats.totalLocked -= (transaction.balanceOwner +
+                              transaction.balanceCounterparty)
+        del self.transactions[transactionId]
+
+    def claimOwner(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.owner is None:
+            raise EscrowError()
+        if sender != transaction.owner:
+            raise EscrowError("Only the owner can claim!")
+        if transaction.ownerHasWithdrawn:
+            raise EscrowError("Owner pending withdrawal from commission!")
+        if not transaction.epoch < now:
+            raise EscrowError("Commission duration not finished!")
+
+        self.settle(transaction, sender, transaction.owner, now)
+
+    ### counterparty interfaces ###
+
+    def acceptCommission(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.counterparty is not None:
+            raise EscrowError("Transaction already has a counterparty.")
+        self.verifyPending(transaction)
+
+        transaction.counterparty = sender
+
+    def leaveCommission(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        self.verifyPending(transaction)
+        if transaction.counterparty != sender:
+            raise EscrowError("Only the counterparty can leave the commission.")
+        if transaction.balanceCounterparty != 0:
+            raise EscrowError("Funds are deposited. Request for cancellation instead.")
+
+        transaction.counterparty = None
+
+    def depositCounterparty(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        self.verifyPending(transaction)
+        if transaction.counterparty != sender:
+            raise EscrowError("Only the counterparty can deposit funds.")
+        if transaction.balanceCounterparty != 0:
+            raise EscrowError("Counterparty already deposited funds.")
+        if amount != transaction.fee:
+            raise EscrowError("Amount does not match fee.")
+
+        transaction.balanceCounterparty += transaction.fee
+        self.stats.totalLocked += transaction.fee
+
+    def cancelCommissionCounterparty(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if transaction.counterparty != sender:
+            raise EscrowError("Only the counterparty can cancel the commission.")
+        if transaction.balanceOwner == 0 or transaction.balanceCounterparty == 0:
+            raise EscrowError("Nobody has deposited funds yet. Leave the commission instead.")
+
+        self.toggleWithdrawn(transaction, "counterparty")
+
+    def claimCounterparty(self, sender, amount, now, transactionId, secret):
+        transaction = self.transactionOf(transactionId)
+        if transaction.counterparty is None:
+            raise EscrowError()
+        if sender != transaction.counterparty:
+            raise EscrowError("Only the counterparty can claim!")
+        if transaction.counterpartyHasWithdrawn:
+            raise EscrowError("Counterparty pending withdrawal from commission!")
+        if not transaction.epoch > now:
+            raise EscrowError("Commission duration expired!")
+        if secret != transaction.secret:
+            raise EscrowError("Secret does not match!")
+
+        self.settle(transaction, sender, transaction.counterparty, now)
+
+    ### admin interfaces ###
+
+    def revertCommissionFunds(self, sender, amount, now, transactionId):
+        transaction = self.transactionOf(transactionId)
+        if sender != self.master:
+            raise EscrowError("Only the admin can revert the commission funds.")
+        if not transaction.ownerHasWithdrawn:
+            raise EscrowError("Owner did not cancel the commission.")
+        if not transaction.counterpartyHasWithdrawn:
+            raise EscrowError("Counterparty did not cancel the commission.")
+        if transaction.status == 2:
+            raise EscrowError("Transaction has already been completed.")
+        if transaction.status == -1:
+            raise EscrowError("Transaction has already been reverted.")
+        if transaction.owner is None or transaction.counterparty is None:
+            raise EscrowError()
+
+        self.pay(transaction.offer + transaction.fee)
+        self.stats.totalLocked -= (transaction.balanceOwner +
+                                   transaction.balanceCounterparty)
+        transaction.balanceOwner = 0
+        transaction.balanceCounterparty = 0
+        self.setStatus(transaction, -1)
+
+    ### invariants ###
+
+    def verifyInvariants(self):
+        """Recount the aggregate counters from the records."""
+        expected = Stats()
+        for transaction in self.transactions.values():
+            counter = STATUS_COUNTERS[transaction.status]
+            setattr(expected, counter, getattr(expected, counter) + 1)
+            expected.pendingReverts += isPendingRevert(transaction)
+            expected.totalLocked += (transaction.balanceOwner +
+                                     transaction.balanceCounterparty)
+        for name in Stats.__slots__:
+            if getattr(self.stats, name) != getattr(expected, name):
+                raise AssertionError("stats.%s is %s, expected %s" % (
+                    name, getattr(self.stats, name), getattr(expected, name)))
+        if self.balance < self.stats.totalLocked:
+            raise AssertionError("Balance %d is below the locked %d" %
+                                 (self.balance, self.stats.totalLocked))
+
+
+### traces ###
+
+ENTRYPOINT_WEIGHTS = dict(
+    postCommission=4,
+    acceptCommission=3,
+    leaveCommission=1,
+    depositOwner=3,
+    depositCounterparty=3,
+    approveCommission=3,
+    activateCommission=1,
+    cancelCommissionOwner=2,
+    cancelCommissionCounterparty=2,
+    revertCommissionFunds=2,
+    claimCounterparty=2,
+    claimOwner=2,
+    deleteCommission=2,
+)
+
+OFFERS = (1000000, 2000000, 5000000)
+FEES = (100000, 1000000)
+DURATIONS = (10, 100, 1000)
+SECRETS = ("secret", "other secret")
+TIME_STEPS = (0, 1, 2, 5, 20, 200)
+
+
+# Shares of the calls of a trace that post a commission, and that are drawn
+# regardless of the state of the model. The others are drawn among the calls
+# the model would accept for a live commission.
+POST_SHARE = 0.08
+NOISE_SHARE = 0.15
+
+COUNTERPARTY_ENTRYPOINTS = ("acceptCommission", "leaveCommission",
+                            "depositCounterparty", "claimCounterparty",
+                            "cancelCommissionCounterparty")
+
+
+def acceptedEntrypoints(transaction, now):
+    """The entrypoints the model accepts for `transaction` at `now`, when
+    called by the party sampleTrace picks for them."""
+    funded = transaction.balanceOwner != 0 and transaction.balanceCounterparty != 0
+    if transaction.status == 0:
+        names = ["cancelCommissionOwner"]
+        if transaction.counterparty is None:
+            names.append("acceptCommission")
+        elif transaction.balanceCounterparty == 0:
+            names += ["leaveCommission", "depositCounterparty"]
+        if transaction.balanceOwner == 0:
+            names.append("depositOwner")
+        if funded:
+            names += ["approveCommission", "activateCommission",
+                      "cancelCommissionCounterparty"]
+        return names
+    if transaction.status == 1:
+        names = ["cancelCommissionOwner", "cancelCommissionCounterparty"]
+        if transaction.ownerHasWithdrawn and transaction.counterpartyHasWithdrawn:
+            names.append("revertCommissionFunds")
+        if not transaction.counterpartyHasWithdrawn and transaction.epoch > now:
+            names.append("claimCounterparty")
+        if not transaction.ownerHasWithdrawn and transaction.epoch < now:
+            names.append("claimOwner")
+        return names
+    return ["deleteCommission", "cancelCommissionOwner"]
+
+
+def sampleTrace(rng, length, now=0):
+    """A random trace of `length` calls, as (entrypoint, sender, amount,
+    now, arguments), drawn from a model the trace is applied to as it is
+    drawn. Most calls are ones the model accepts for a live commission;
+    posts take a new ID or that of a deleted commission, and a share of
+    calls is drawn at random to exercise the failures."""
+    names = list(ENTRYPOINT_WEIGHTS)
+    weights = list(ENTRYPOINT_WEIGHTS.values())
+    escrow = Escrow()
+    freed = []
+    posted = 0
+    trace = []
+
+    for _ in range(length):
+        now += rng.choice(TIME_STEPS)
+        live = sorted(escrow.transactions)
+        draw = rng.random()
+        amount = 0
+
+        if not live or draw < POST_SHARE:
+            entrypoint = "postCommission"
+            if freed and rng.random() < 0.5:
+                transactionId = freed.pop(rng.randrange(len(freed)))
+            elif live and rng.random() < 0.05:
+                transactionId = rng.choice(live)
+            else:
+                transactionId = "c%d" % posted
+                posted += 1
+            sender = rng.choice((OWNER, COUNTERPARTY))
+            args = (transactionId, rng.choice(OFFERS), rng.choice(FEES),
+                    rng.choice(DURATIONS), rng.choice(SECRETS),
+                    "Commission %s" % transactionId, "Title")
+        elif draw < POST_SHARE + NOISE_SHARE:
+            entrypoint = rng.choices(names, weights)[0]
+            transactionId = rng.choice(live + freed)
+            sender = rng.choice(ACCOUNTS)
+            if entrypoint == "postCommission":
+                args = (transactionId, rng.choice(OFFERS), rng.choice(FEES),
+                        rng.choice(DURATIONS), rng.choice(SECRETS),
+                        "Commission %s" % transactionId, "Title")
+            elif entrypoint == "claimCounterparty":
+                args = (transactionId, rng.choice(SECRETS))
+            else:
+                args = (transactionId,)
+            if entrypoint in ("depositOwner", "depositCounterparty"):
+                amount = rng.choice(OFFERS + FEES)
+        else:
+            transactionId = rng.choice(live)
+            transaction = escrow.transactions[transactionId]
+            accepted = acceptedEntrypoints(transaction, now)
+            entrypoint = rng.choices(
+                accepted, [ENTRYPOINT_WEIGHTS[name] for name in accepted])[0]
+            if entrypoint in COUNTERPARTY_ENTRYPOINTS:
+                sender = transaction.counterparty or rng.choice((COUNTERPARTY, OUTSIDER))
+            elif entrypoint == "revertCommissionFunds":
+                sender = ADMIN
+            else:
+                sender = transaction.owner
+            args = (transactionId,)
+            if entrypoint == "claimCounterparty":
+                args = (transactionId, transaction.secret)
+            elif entrypoint == "depositOwner":
+                amount = transaction.offer
+            elif entrypoint == "depositCounterparty":
+                amount = transaction.fee
+
+        call = (entrypoint, sender, amount, now, args)
+        try:
+            escrow.apply(call)
+        except EscrowError:
+            pass
+        if transactionId in escrow.transactions:
+            if transactionId in freed:
+                freed.remove(transactionId)
+        elif entrypoint == "deleteCommission" and transactionId not in freed:
+            freed.append(transactionId)
+        trace.append(call)
+    return trace
+
+
+def replay(trace, check=False):
+    """Apply a trace to a new model. Returns the model and the number of
+    calls that failed."""
+    escrow = Escrow()
+    failed = 0
+    for call in trace:
+        try:
+            escrow.apply(call)
+        except EscrowError:
+            failed += 1
+        if check:
+            escrow.verifyInvariants()
+    return escrow, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--transitions", type=int, default=1000000)
+    parser.add_argument("--trace-length", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true",
+                        help="verify the invariants after every call")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    traces = [sampleTrace(rng, args.trace_length)
+              for _ in range(max(1, args.transitions // args.trace_length))]
+
+    failed = 0
+    start = time.perf_counter()
+    for trace in traces:
+        failed += replay(trace, args.check)[1]
+    elapsed = time.perf_counter() - start
+
+    transitions = sum(len(trace) for trace in traces)
+    print("%d transitions (%d failed) in %.2fs: %d transitions/s" % (
+        transitions, failed, elapsed, transitions / elapsed))
+
+
+if __name__ == "__main__":
+    main()
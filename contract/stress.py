@@ -0,0 +1,134 @@
+"""Escrow at scale: simulator wall time and gas as the big_maps grow.
+
+Two measurements, both offline:
+
+* the wall time of the SmartPy stress scenario (contract/stress_scenario.py),
+  which creates, funds and settles --commissions commissions;
+* the gas of one full commission lifecycle, probed in an octez-client mockup
+  after the contract was filled with a growing number of posted commissions.
+
+    python contract/stress.py --commissions 20000
+    python contract/stress.py --skip-scenario --sizes 0 1000 10000 50000
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from benchmark import (CONTRACT, COUNTER_TARGETS, SMARTPY_CLI, Keys, Mockup,
+                       compileTargets, fund, hashedSecret, record,
+                       requireTool, string)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIO = os.path.join(HERE, "stress_scenario.py")
+
+# Commissions posted per postCommissions call while filling the contract.
+BATCH = 100
+
+
+def runScenario(commissions, seed):
+    """Wall time in seconds of the SmartPy stress scenario."""
+    environment = dict(os.environ, STRESS_COMMISSIONS=str(commissions),
+                       STRESS_SEED=str(seed))
+    requireTool(SMARTPY_CLI, "SMARTPY_CLI")
+    with tempfile.TemporaryDirectory() as outputDir:
+        start = time.perf_counter()
+        subprocess.run([SMARTPY_CLI, "test", SCENARIO, outputDir],
+                       cwd=os.path.dirname(HERE), env=environment,
+                       check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+
+def filler(keys, start, count):
+    """postCommissions argument posting `count` commissions. Their IDs are
+    options only with counter keys."""
+    return "{ %s }" % "; ".join(record(
+        transactionId=keys.post("fill-%d" % index) if keys.counterIds
+        else string("fill-%d" % index),
+        offer=1000000,
+        fee=100000,
+        duration=3600,
+        hashedSecret=hashedSecret("secret"),
+        description=string("Filler commission %d" % index),
+        title=string("Filler"),
+    ) for index in range(start, start + count))
+
+
+def probe(keys, transactionId):
+    return fund(keys, transactionId) + [
+        ("claimCounterparty", record(
+            transactionId=keys(transactionId),
+            secret="(Some %s)" % string("secret"),
+        ), "counterparty", 0),
+    ]
+
+
+def gasTrend(name, code, storage, sizes):
+    """[(commissions, {entrypoint: gas}, seconds spent filling)]"""
+    keys = Keys(name in COUNTER_TARGETS)
+    trend = []
+    with tempfile.TemporaryDirectory() as baseDir:
+        mockup = Mockup(baseDir)
+        mockup.originate(name, code, storage)
+        posted = 0
+        for size in sorted(sizes):
+            start = time.perf_counter()
+            while posted < size:
+                count = min(BATCH, size - posted)
+                mockup.call(name, "postCommissions",
+                            filler(keys, posted, count), "owner")
+                posted += count
+            filling = time.perf_counter() - start
+
+            gas = {}
+            for entrypoint, arg, sender, amount in probe(keys, "probe-%d" % size):
+                gas[entrypoint] = mockup.call(
+                    name, entrypoint, arg, sender, amount)["gas"]
+            # The probe commission is part of the maps from now on.
+            posted += 1
+            trend.append((size, gas, filling))
+    return trend
+
+
+def printTrend(trend):
+    entrypoints = list(trend[0][1])
+    print("%-12s" % "commissions" + "".join(
+        "%22s" % entrypoint for entrypoint in entrypoints) + "%14s" % "fill time")
+    first = trend[0][1]
+    for size, gas, filling in trend:
+        print("%-12d" % size + "".join(
+            "%22s" % ("%s (%+g)" % (gas[entrypoint],
+                                    round(gas[entrypoint] - first[entrypoint], 3)))
+            for entrypoint in entrypoints) + "%13.1fs" % filling)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--target", default="escrow")
+    parser.add_argument("--commissions", type=int, default=10000,
+                        help="commissions settled by the SmartPy scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[0, 1000, 5000, 10000, 20000],
+                        help="commissions in the contract when the gas of a "
+                             "lifecycle is probed")
+    parser.add_argument("--skip-scenario", action="store_true")
+    parser.add_argument("--skip-gas", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_scenario:
+        seconds = runScenario(args.commissions, args.seed)
+        print("SmartPy scenario: %d commissions in %.1fs (%.2f ms each)" % (
+            args.commissions, seconds, 1000 * seconds / args.commissions))
+        print()
+
+    if not args.skip_gas:
+        with tempfile.TemporaryDirectory() as outputDir:
+            code, storage = compileTargets(CONTRACT, outputDir)[args.target]
+            printTrend(gasTrend(args.target, code, storage, args.sizes))
+
+
+if __name__ == "__main__":
+    main()
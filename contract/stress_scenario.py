@@ -0,0 +1,122 @@
+"""Stress scenario: many commissions in one Escrow.
+
+Commissions are created, funded and settled in waves by randomized actors at
+randomized times, so the transactions and parties big_maps keep growing. The
+aggregate counters and the balance are checked after every wave. The size and
+seed are read from the environment; contract/stress.py runs and times it:
+
+    STRESS_COMMISSIONS=20000 ~/smartpy-cli/SmartPy.sh test contract/stress_scenario.py output
+"""
+
+import collections
+import os
+import random
+
+import smartpy as sp
+
+# Imported under a templates name, so that only this scenario runs and none
+# of the scenarios or compilation targets of Escrow.py.
+Escrow = sp.io.import_script_from_url(
+    "file:contract/Escrow.py", name="templates/Escrow").Escrow
+
+COMMISSIONS = int(os.environ.get("STRESS_COMMISSIONS", "10000"))
+SEED = int(os.environ.get("STRESS_SEED", "0"))
+WAVE = 500
+ACTORS = 64
+
+# Durations long enough for claimCounterparty to land before the deadline,
+# and short enough for claimOwner to land after it.
+LONG_DURATION = 10 ** 8
+SHORT_DURATION = 100
+
+Commission = collections.namedtuple("Commission", [
+    "transactionId", "owner", "counterparty", "offer", "fee", "outcome",
+    "duration"])
+
+
+@sp.add_test(name="EscrowStress")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Escrow with %d commissions" % COMMISSIONS)
+
+    rng = random.Random(SEED)
+    admin = sp.address("tz1M2aPGQJpXBfXX9LPgDuj6vAv4K2pi14Pf")
+    actors = [sp.test_account("Actor %d" % index).address
+              for index in range(ACTORS)]
+
+    c1 = Escrow(admin, stats=True)
+    scenario += c1
+
+    now = 0
+    completed = cancelled = 0
+
+    def run(call, sender, amount=0):
+        nonlocal now
+        now += rng.randint(0, 10)
+        scenario += call.run(sender=sender, amount=sp.mutez(amount),
+                             now=sp.timestamp(now), valid=True, show=False)
+
+    for start in range(0, COMMISSIONS, WAVE):
+        scenario.h2("Commissions %d to %d" %
+                    (start, min(start + WAVE, COMMISSIONS) - 1))
+        wave = []
+        for index in range(start, min(start + WAVE, COMMISSIONS)):
+            owner, counterparty = rng.sample(actors, 2)
+            outcome = rng.choice(["counterparty", "owner", "revert"])
+            wave.append(Commission(
+                transactionId="stress-%d" % index,
+                owner=owner,
+                counterparty=counterparty,
+                offer=rng.randint(1, 100) * 100000,
+                fee=rng.randint(1, 10) * 10000,
+                outcome=outcome,
+                duration=SHORT_DURATION if outcome == "owner" else LONG_DURATION,
+            ))
+
+        for c in wave:
+            run(c1.postCommission(
+                transactionId=sp.some(c.transactionId),
+                offer=sp.mutez(c.offer),
+                fee=sp.mutez(c.fee),
+                duration=c.duration,
+                secret="secret %s" % c.transactionId,
+                description="Stress commission %s" % c.transactionId,
+                title="Stress",
+            ), c.owner)
+        for c in rng.sample(wave, len(wave)):
+            run(c1.acceptCommission(c.transactionId), c.counterparty)
+        for c in rng.sample(wave, len(wave)):
+            run(c1.depositOwner(c.transactionId), c.owner, c.offer)
+            run(c1.depositCounterparty(c.transactionId), c.counterparty, c.fee)
+        for c in rng.sample(wave, len(wave)):
+            run(c1.approveCommission(c.transactionId), c.owner)
+
+        scenario.verify(c1.data.stats.active == len(wave))
+        scenario.verify(c1.data.stats.totalLocked ==
+                        sp.mutez(sum(c.offer + c.fee for c in wave)))
+
+        for c in rng.sample(wave, len(wave)):
+            if c.outcome == "counterparty":
+                run(c1.claimCounterparty(
+                    transactionId=c.transactionId,
+                    secret=sp.some("secret %s" % c.transactionId),
+                ), c.counterparty)
+            elif c.outcome == "revert":
+                run(c1.cancelCommissionOwner(c.transactionId), c.owner)
+                run(c1.cancelCommissionCounterparty(c.transactionId),
+                    c.counterparty)
+                run(c1.revertCommissionFunds(c.transactionId), admin)
+        now += SHORT_DURATION + 1
+        for c in rng.sample(wave, len(wave)):
+            if c.outcome == "owner":
+                run(c1.claimOwner(c.transactionId), c.owner)
+
+        completed += sum(c.outcome != "revert" for c in wave)
+        cancelled += sum(c.outcome == "revert" for c in wave)
+        scenario.verify(c1.data.stats.pending == 0)
+        scenario.verify(c1.data.stats.active == 0)
+        scenario.verify(c1.data.stats.completed == completed)
+        scenario.verify(c1.data.stats.cancelled == cancelled)
+        scenario.verify(c1.data.stats.pendingReverts == 0)
+        scenario.verify(c1.data.stats.totalLocked == sp.mutez(0))
+        scenario.verify(c1.balance == sp.mutez(0))
@@ -0,0 +1,57 @@
+"""Round trip of commission metadata through the file-backed store.
+
+    python -m unittest contract/test_metadata_store.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metadata_store import SCHEME, MetadataStore, contentHash, encode  # noqa: E402
+
+TITLE = "Cat caretaker"
+DESCRIPTION = "Need someone to take care of my cat in 100 seconds!"
+
+# The metadataHash the off-chain scenario of Escrow.py posts for them.
+DIGEST = "71bd57a4d1320a989853048e529036244856b2953a90cfeae71afea33cbfa03a"
+
+
+class MetadataStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = MetadataStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def testRoundTrip(self):
+        metadataHash, metadataUri = self.store.put(TITLE, DESCRIPTION)
+        self.assertEqual(metadataHash, contentHash(encode(TITLE, DESCRIPTION)))
+        self.assertEqual(metadataHash.hex(), DIGEST)
+        self.assertEqual(len(metadataHash), 32)
+        self.assertEqual(metadataUri, SCHEME + DIGEST)
+        self.assertEqual(self.store.get(metadataUri, metadataHash),
+                         dict(title=TITLE, description=DESCRIPTION))
+
+    def testTamperedDocument(self):
+        metadataHash, metadataUri = self.store.put(TITLE, DESCRIPTION)
+        with open(self.store.path(metadataHash), "wb") as f:
+            f.write(encode(TITLE, "Feed my dog instead."))
+        with self.assertRaises(ValueError):
+            self.store.get(metadataUri, metadataHash)
+
+    def testOtherOnchainHash(self):
+        _, metadataUri = self.store.put(TITLE, DESCRIPTION)
+        with self.assertRaises(ValueError):
+            self.store.get(metadataUri, bytes(32))
+
+    def testUnsupportedUri(self):
+        with self.assertRaises(ValueError):
+            self.store.get("ipfs://" + DIGEST)
+
+
+if __name__ == "__main__":
+    unittest.main()
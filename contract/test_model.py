@@ -0,0 +1,76 @@
+"""Random traces through the reference model of the Escrow contract.
+
+    python -m unittest contract/test_model.py
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from model import (ADMIN, COUNTERPARTY, OWNER, PARAMETERS, Escrow,  # noqa: E402
+                   EscrowError, replay, sampleTrace)
+
+SEEDS = range(10)
+TRACE_LENGTH = 1000
+
+
+class ModelTest(unittest.TestCase):
+    def testInvariants(self):
+        for seed in SEEDS:
+            trace = sampleTrace(random.Random(seed), TRACE_LENGTH)
+            _, failed = replay(trace, check=True)
+            self.assertLess(failed, len(trace) // 4)
+
+    def testEveryEntrypointSucceeds(self):
+        succeeded = set()
+        for seed in SEEDS:
+            escrow = Escrow()
+            for call in sampleTrace(random.Random(seed), TRACE_LENGTH):
+                try:
+                    escrow.apply(call)
+                except EscrowError:
+                    continue
+                succeeded.add(call[0])
+        self.assertEqual(succeeded, set(PARAMETERS))
+
+    def testDeletedIdsArePostedAgain(self):
+        escrow = Escrow()
+        posted = set()
+        reposted = 0
+        for call in sampleTrace(random.Random(0), TRACE_LENGTH):
+            try:
+                escrow.apply(call)
+            except EscrowError:
+                continue
+            if call[0] == "postCommission":
+                reposted += call[4][0] in posted
+                posted.add(call[4][0])
+        self.assertGreater(reposted, 0)
+
+    def testCancelledAfterCompletion(self):
+        escrow = Escrow()
+        for call in [
+            ("postCommission", OWNER, 0, 0,
+             ("first", 100, 1, 100, "secret", "Commission", "Title")),
+            ("acceptCommission", COUNTERPARTY, 0, 0, ("first",)),
+            ("depositOwner", OWNER, 100, 0, ("first",)),
+            ("depositCounterparty", COUNTERPARTY, 1, 0, ("first",)),
+            ("approveCommission", OWNER, 0, 0, ("first",)),
+            ("cancelCommissionCounterparty", COUNTERPARTY, 0, 10, ("first",)),
+            ("claimOwner", OWNER, 0, 200, ("first",)),
+            ("cancelCommissionOwner", OWNER, 0, 210, ("first",)),
+        ]:
+            escrow.apply(call)
+        self.assertEqual(escrow.stats.pendingReverts, 0)
+        escrow.verifyInvariants()
+        with self.assertRaises(EscrowError) as failure:
+            escrow.apply(("revertCommissionFunds", ADMIN, 0, 220, ("first",)))
+        self.assertEqual(failure.exception.message,
+                         "Transaction has already been completed.")
+
+
+if __name__ == "__main__":
+    unittest.main()
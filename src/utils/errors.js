@@ -0,0 +1,70 @@
+// Generated by contract/errors.py from the ERRORS table of
+// contract/Escrow.py. Do not edit.
+
+export const errors = {
+  "1": "Transaction already exists.",
+  "2": "Unknown status.",
+  "3": "Only the admin can reset!",
+  "4": "Only the admin can create a transaction!",
+  "5": "Metadata hash must be 32 bytes.",
+  "6": "Metadata URI is too long.",
+  "7": "Commission details are stored off-chain.",
+  "8": "Commission details are stored on-chain.",
+  "9": "Only the admin can migrate a commission.",
+  "10": "Amount does not match the migrated balances.",
+  "11": "Commissions are not keyed by counter.",
+  "12": "Transaction does not exist.",
+  "13": "Only admin can set transaction details.",
+  "14": "Owner already set.",
+  "15": "Counterparty already set.",
+  "16": "Only the admin can revert the commission funds.",
+  "17": "Owner did not cancel the commission.",
+  "18": "Counterparty did not cancel the commission.",
+  "19": "Transaction has already been completed.",
+  "20": "Transaction has already been reverted.",
+  "21": "Reverts are not queued.",
+  "22": "Only owner can start transaction.",
+  "23": "Transaction is not pending.",
+  "24": "Both parties must deposit first!",
+  "25": "Only the owner can edit the commission reward.",
+  "26": "Owner has already deposited.",
+  "27": "Only the owner can edit the commission fee.",
+  "28": "Counterparty has already deposited.",
+  "29": "Only the owner can edit the commission details.",
+  "30": "Only the owner can edit the commission description.",
+  "31": "Only the owner can cancel the commission.",
+  "32": "Only the owner can delete the commission.",
+  "33": "Only the owner can deposit funds.",
+  "34": "Owner already deposited funds.",
+  "35": "Amount does not match offer.",
+  "36": "Amount does not match the total offer.",
+  "37": "Transaction already has a counterparty.",
+  "38": "Only the counterparty can cancel the commission.",
+  "39": "Nobody has deposited funds yet. Leave the commission instead.",
+  "40": "Only the counterparty can deposit funds.",
+  "41": "Counterparty already deposited funds.",
+  "42": "Amount does not match fee.",
+  "43": "Amount does not match the total fee.",
+  "44": "Only the counterparty can leave the commission.",
+  "45": "Funds are deposited. Request for cancellation instead.",
+  "46": "Owner did not deposit funds.",
+  "47": "Counterparty did not deposit funds.",
+  "48": "Only the owner can approve the commission.",
+  "49": "Nothing to withdraw.",
+  "50": "Settlements are paid out directly.",
+  "51": "Transaction is not active.",
+  "52": "Both parties must deposit!",
+  "53": "Only the owner or counterparty can claim!",
+  "54": "Only the counterparty can claim!",
+  "55": "Counterparty pending withdrawal from commission!",
+  "56": "Commission duration expired!",
+  "57": "Secret does not match!",
+  "58": "Only the owner can claim!",
+  "59": "Owner pending withdrawal from commission!",
+  "60": "Commission duration not finished!",
+  "61": "Expiries are not queued."
+};
+
+// Message of a failure raised by a build with errorCodes=True.
+// Failures of other builds are already messages.
+export const errorMessage = (code) => errors[code] || code;
@@ -49,6 +49,43 @@ export const acceptCommision = async (transactionId) => {
   });
 };
 
+export const acceptAndDeposit = async (transactionId, amount) => {
+  const contract = await tezos.wallet.at(contractAddress);
+  const opEntry = contract.methods
+    .acceptAndDeposit(transactionId)
+    .toTransferParams({ amount: amount, mutez: true });
+
+  const estimate = await tezos.estimate.transfer(opEntry);
+
+  const op = await contract.methods.acceptAndDeposit(transactionId).send({
+    fee:
+      estimate.suggestedFeeMutez +
+      increasedFee(gasBuffer, Number(estimate.opSize)),
+    gasLimit: estimate.gasLimit + gasBuffer,
+    storageLimit: estimate.storageLimit,
+    amount: amount,
+    mutez: true,
+  });
+  await new Promise((resolve, reject) => {
+    const evts = [];
+
+    op.confirmationObservable(1).subscribe(
+      (event) => {
+        const entry = {
+          level: event.block.header.level,
+          currentConfirmation: event.currentConfirmation,
+        };
+        evts.push(entry);
+      },
+      () => reject(null),
+      () => {
+        toast.success('Transaction posted');
+        resolve(evts);
+      }
+    );
+  });
+};
+
 export const approveCommission = async (transactionId) => {
   const contract = await tezos.wallet.at(contractAddress);
   const opEntry = contract.methods
@@ -345,6 +382,45 @@ export const postCommission = async (transaction) => {
   });
 };
 
+export const postAndDeposit = async (transaction, amount) => {
+  const contract = await tezos.wallet.at(contractAddress);
+  const transactionId = uuidv4();
+  transaction.transactionId = transactionId;
+  const opEntry = contract.methodsObject
+    .postAndDeposit(transaction)
+    .toTransferParams({ amount: amount, mutez: true });
+  const estimate = await tezos.estimate.transfer(opEntry);
+
+  const op = await contract.methodsObject.postAndDeposit(transaction).send({
+    fee:
+      estimate.suggestedFeeMutez +
+      increasedFee(gasBuffer, Number(estimate.opSize)),
+    gasLimit: estimate.gasLimit + gasBuffer,
+    storageLimit: estimate.storageLimit,
+    amount: amount,
+    mutez: true,
+  });
+
+  await new Promise((resolve, reject) => {
+    const evts = [];
+
+    op.confirmationObservable(1).subscribe(
+      (event) => {
+        const entry = {
+          level: event.block.header.level,
+          currentConfirmation: event.currentConfirmation,
+        };
+        evts.push(entry);
+      },
+      () => reject(null),
+      () => {
+        toast.success('Transaction posted');
+        resolve(evts);
+      }
+    );
+  });
+};
+
 export const createTransaction = async () => {
   const contract = await tezos.wallet.at(contractAddress);
   const opEntry = contract.methods.createTransaction().toTransferParams({});
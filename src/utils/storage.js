@@ -141,3 +141,31 @@ export const getUserTransactions = async (account) => {
     console.log(error);
   }
 };
+
+// Only available when the contract is deployed with userIndex=True. Returns
+// the IDs the account owns and is the counterparty of as
+// { owner: [...], counterparty: [...] } with a single big_map key read.
+export const getUserCommissions = async (account) => {
+  try {
+    const response = await axios.get(
+      `https://api.${network}.tzkt.io/v1/contracts/${contractAddress}/bigmaps/userCommissions/keys/${account}`
+    );
+
+    return response.data ? response.data.value : { owner: [], counterparty: [] };
+  } catch (error) {
+    console.log(error);
+  }
+};
+
+// Running totals kept by contracts built with stats=True: the number of
+// commissions in each status, the number of pending reverts and the mutez
+// locked in commissions. Undefined for contracts built without them.
+export const getStats = async () => {
+  try {
+    const storage = await getStorage();
+
+    return storage.stats;
+  } catch (error) {
+    console.log(error);
+  }
+};